@@ -0,0 +1,68 @@
+import time
+
+from collections import OrderedDict
+
+DAY = 24 * 60 * 60
+
+
+class AttachmentCache:
+    """
+    Map image urls and image content hashes to saved VK attachments
+    (`photo<owner_id>_<id>`), so one poster shared by many events is
+    uploaded once.
+
+    Both maps are LRU with `maxsize` entries and expire after `ttl`.
+    Attachments rejected by VK are `invalidate`d: dropped from both maps
+    and remembered, so stale `Event.attach` values are uploaded again.
+    """
+
+    def __init__(self, maxsize=10000, ttl=30 * DAY):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.urls = OrderedDict()
+        self.hashes = OrderedDict()
+        self.invalid = OrderedDict()
+        self.hits = self.misses = 0
+
+    def _get(self, data, key):
+        item = data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.time():
+            del data[key]
+            return None
+        data.move_to_end(key)
+        return value
+
+    def _set(self, data, key, value):
+        data[key] = (time.time() + self.ttl, value)
+        data.move_to_end(key)
+        while len(data) > self.maxsize:
+            data.popitem(last=False)
+
+    def get(self, url):
+        digest = self._get(self.urls, url)
+        attach = self._get(self.hashes, digest) if digest else None
+        if attach:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return attach
+
+    def get_by_hash(self, digest):
+        return self._get(self.hashes, digest)
+
+    def set(self, url, digest, attach):
+        self.invalid.pop(attach, None)
+        self._set(self.urls, url, digest)
+        self._set(self.hashes, digest, attach)
+
+    def is_valid(self, attach):
+        return bool(attach) and self._get(self.invalid, attach) is None
+
+    def invalidate(self, attach):
+        for digest, (expires, value) in list(self.hashes.items()):
+            if value == attach:
+                del self.hashes[digest]
+        self._set(self.invalid, attach, True)
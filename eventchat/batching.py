@@ -0,0 +1,171 @@
+import logging
+import asyncio
+import ujson
+
+from aiovk import TokenSession
+from aiovk.exceptions import VkAPIError
+
+logger = logging.getLogger(__name__)
+
+# VK allows up to 25 API calls inside one `execute`
+MAX_CALLS = 25
+
+
+class ExecuteError(Exception):
+    """
+    Call failed inside `execute`, `error_code` and `error_msg` of
+    `VkAPIError` come from `execute_errors` when VK gave them.
+    """
+
+    def __init__(self, message, error_code=None, error_msg=None):
+        super().__init__(message)
+        self.error_code = error_code
+        self.error_msg = error_msg
+
+
+class ExecuteResult(list):
+    """
+    Results of `execute` calls, `errors` are its `execute_errors`:
+    `{'method', 'error_code', 'error_msg'}` of every failed call.
+    """
+
+    def __init__(self, results, errors=()):
+        super().__init__(results)
+        self.errors = list(errors)
+
+
+class ExecuteSession(TokenSession):
+    """
+    `TokenSession` keeping `execute_errors` as `ExecuteResult.errors`,
+    plain `TokenSession` drops them with the rest of the response.
+    """
+
+    @asyncio.coroutine
+    def send_api_request(self, method_name, params=None, timeout=None):
+        if method_name != 'execute':
+            result = yield from super().send_api_request(
+                method_name, params, timeout
+            )
+            return result
+        params = dict(params or {}, v=self.API_VERSION)
+        if self.access_token:
+            params['access_token'] = self.access_token
+        url = self.REQUEST_URL + method_name
+        response = yield from self.driver.json(
+            url, params, timeout or self.timeout
+        )
+        if response.get('error'):
+            raise VkAPIError(response['error'], url)
+        result = response['response']
+        if isinstance(result, list):
+            result = ExecuteResult(result, response.get('execute_errors', ()))
+        return result
+
+
+class ExecuteBatcher:
+    """
+    Pack VK API calls made within `delay` seconds into one `execute`
+    request of up to `max_calls` calls, each `execute` counts as one
+    request against VK per-second limit.
+
+    `call` looks like `aiovk.API.__call__` and returns own result of the
+    call. Calls run inside `execute` in the order they were made; a call
+    that failed inside `execute` (VK returns `false` for it) raises
+    `ExecuteError` to its caller only, with VK error code if `vk` runs
+    on `ExecuteSession`.
+    """
+
+    def __init__(self, vk, max_calls=MAX_CALLS, delay=0.01,
+                 max_code_size=16000, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.vk = vk
+        self.max_calls = min(max_calls, MAX_CALLS)
+        self.delay = delay
+        self.max_code_size = max_code_size
+        self.queue = []
+        self._handle = None
+
+    @staticmethod
+    def compile(method, params):
+        return 'API.%s(%s)' % (method, ujson.dumps(params, ensure_ascii=False))
+
+    @asyncio.coroutine
+    def call(self, method, **params):
+        future = self.loop.create_future()
+        self.queue.append((method, params, future))
+        if len(self.queue) >= self.max_calls:
+            self.flush()
+        elif self._handle is None:
+            self._handle = self.loop.call_later(self.delay, self.flush)
+        result = yield from future
+        return result
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        while self.queue:
+            batch, codes, size = [], [], 0
+            for method, params, future in self.queue[:self.max_calls]:
+                code = self.compile(method, params)
+                size += len(code) + 1
+                if batch and size > self.max_code_size:
+                    break
+                batch.append((method, params, future))
+                codes.append(code)
+            self.queue = self.queue[len(batch):]
+            self.loop.create_task(self._execute(batch, codes))
+
+    @staticmethod
+    def pop_error(errors, method):
+        for index, error in enumerate(errors):
+            if error.get('method') == method:
+                return errors.pop(index)
+        return {}
+
+    @asyncio.coroutine
+    def _execute(self, batch, codes):
+        try:
+            if len(batch) == 1:
+                # nothing to pack, skip `execute` overhead
+                method, params, _ = batch[0]
+                result = yield from self.vk(method, **params)
+                results = [result]
+            else:
+                results = yield from self.vk(
+                    'execute',
+                    code='return [%s];' % ','.join(codes)
+                )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if not isinstance(results, list):
+            results = []
+        if len(results) != len(batch):
+            logger.warning('execute returned %s results for %s calls',
+                           len(results), len(batch))
+        # errors are listed in order of failed calls
+        errors = list(getattr(results, 'errors', ()))
+
+        for index, (method, _, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index >= len(results):
+                # never leave caller waiting
+                future.set_exception(
+                    ExecuteError('%s got no result from execute' % method)
+                )
+            elif results[index] is False:
+                error = self.pop_error(errors, method)
+                future.set_exception(ExecuteError(
+                    '%s failed inside execute: %s' % (
+                        method, error.get('error_msg')
+                    ),
+                    error_code=error.get('error_code'),
+                    error_msg=error.get('error_msg'),
+                ))
+            else:
+                future.set_result(results[index])
@@ -0,0 +1,113 @@
+import logging
+import asyncio
+
+import aiohttp
+import async_timeout
+import ujson
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = 'https://api.api.ai/v1/'
+API_VERSION = '20150910'
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class DialogflowError(Exception):
+    pass
+
+
+class DialogflowClient:
+    """
+    Asyncio Dialogflow (api.ai v1) client.
+    Keeps one pooled aiohttp session so many `query` calls can be in
+    flight at once; every request has its own timeout and is retried
+    with exponential backoff on network errors and 429/5xx answers.
+    """
+
+    def __init__(self, token, lang='ru', base_url=BASE_URL,
+                 version=API_VERSION, timeout=5, retries=2, backoff=0.2,
+                 pool_size=100, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.token = token
+        self.lang = lang
+        self.url = '%squery?v=%s' % (base_url, version)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.headers = {
+            'Authorization': 'Bearer %s' % token,
+            'Content-Type': 'application/json; charset=utf-8',
+        }
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                loop=self.loop
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                loop=self.loop
+            )
+        return self._session
+
+    @asyncio.coroutine
+    def query(self, session_id, message, **kwargs):
+        """
+        Send `message` to Dialogflow and return decoded json answer.
+        Extra `kwargs` are merged into request body (`contexts`,
+        `resetContexts`, `timezone` ...).
+        """
+        body = {
+            'query': message,
+            'lang': self.lang,
+            'sessionId': str(session_id),
+        }
+        body.update(kwargs)
+        data = ujson.dumps(body)
+
+        attempt = 0
+        while True:
+            try:
+                text = yield from self._post(data)
+                return ujson.loads(text)
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise DialogflowError(
+                        'query failed after %s attempts: %r' % (attempt, e)
+                    ) from e
+                delay = self.backoff * 2 ** (attempt - 1)
+                logger.debug('dialogflow retry %s in %ss: %r',
+                             attempt, delay, e)
+                yield from asyncio.sleep(delay, loop=self.loop)
+
+    @asyncio.coroutine
+    def _post(self, data):
+        with async_timeout.timeout(self.timeout, loop=self.loop):
+            response = yield from self.session.post(
+                self.url,
+                data=data,
+                headers=self.headers
+            )
+            try:
+                if response.status in RETRY_STATUSES:
+                    raise aiohttp.ClientResponseError(
+                        response.request_info,
+                        response.history,
+                        code=response.status,
+                        message=response.reason,
+                    )
+                text = yield from response.text()
+            finally:
+                response.release()
+        return text
+
+    @asyncio.coroutine
+    def close(self):
+        if self._session is not None and not self._session.closed:
+            self._session.close()
+        self._session = None
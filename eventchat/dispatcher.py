@@ -0,0 +1,79 @@
+import logging
+import asyncio
+
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class UserDispatcher:
+    """
+    Route incoming messages into one ordered queue per `user_id` and
+    process different users concurrently with `concurrency` workers.
+
+    A user is owned by at most one worker at a time, so messages of the
+    same user are handled strictly in order. After every message the
+    user goes to the back of the ready queue, so one chatty user can't
+    starve others.
+    """
+
+    def __init__(self, handler, concurrency=10, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queues = {}
+        self.ready = asyncio.Queue(loop=self.loop)
+        self.workers = []
+
+    @property
+    def pending(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def put(self, user_id, message):
+        queue = self.queues.get(user_id)
+        if queue is None:
+            queue = self.queues[user_id] = deque()
+            queue.append(message)
+            self.ready.put_nowait(user_id)
+        else:
+            # user is queued or handled by a worker right now,
+            # worker reschedules him after current message
+            queue.append(message)
+
+    def start(self):
+        if not self.workers:
+            self.workers = [
+                self.loop.create_task(self._worker())
+                for _ in range(self.concurrency)
+            ]
+
+    @asyncio.coroutine
+    def join(self):
+        yield from self.ready.join()
+
+    @asyncio.coroutine
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        if self.workers:
+            yield from asyncio.wait(self.workers, loop=self.loop)
+        self.workers = []
+
+    @asyncio.coroutine
+    def _worker(self):
+        while True:
+            user_id = yield from self.ready.get()
+            queue = self.queues[user_id]
+            message = queue.popleft()
+            try:
+                yield from self.handler(user_id, message)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('failed to handle message of %s', user_id)
+            finally:
+                if queue:
+                    self.ready.put_nowait(user_id)
+                else:
+                    del self.queues[user_id]
+                self.ready.task_done()
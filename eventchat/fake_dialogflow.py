@@ -0,0 +1,94 @@
+import asyncio
+
+from aiohttp import web
+
+
+def make_answer(query, action='input.unknown', parameters=None,
+                speech='', contexts=None):
+    """
+    Minimal Dialogflow v1 `/query` answer used by `VKChat.send_answer`.
+    """
+    return {
+        'status': {'code': 200, 'errorType': 'success'},
+        'result': {
+            'resolvedQuery': query,
+            'action': action,
+            'parameters': parameters or {},
+            'contexts': contexts or [],
+            'fulfillment': {'speech': speech},
+        },
+    }
+
+
+class FakeDialogflowServer:
+    """
+    Local Dialogflow stand-in for tests and benchmarks.
+
+    Usage:
+        server = FakeDialogflowServer(answers={'hi': {...}}, delay=0.1)
+        yield from server.start()
+        client = DialogflowClient('token', base_url=server.base_url)
+        ...
+        yield from server.stop()
+
+    `delay` emulates NLU latency, `fail_times` makes the first N requests
+    answer with 503 to exercise client retries.
+    """
+
+    def __init__(self, answers=None, delay=0, fail_times=0,
+                 host='127.0.0.1', port=0, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.answers = answers or {}
+        self.delay = delay
+        self.fail_times = fail_times
+        self.host = host
+        self.port = port
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        self.app = web.Application(loop=self.loop)
+        self.app.router.add_post('/v1/query', self.handle_query)
+        self._handler = None
+        self._server = None
+
+    @property
+    def base_url(self):
+        return 'http://%s:%s/v1/' % (self.host, self.port)
+
+    @asyncio.coroutine
+    def handle_query(self, request):
+        body = yield from request.json()
+        self.requests.append(body)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.delay:
+                yield from asyncio.sleep(self.delay, loop=self.loop)
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                return web.Response(status=503)
+            query = body.get('query', '')
+            answer = self.answers.get(query) or make_answer(query)
+            return web.json_response(answer)
+        finally:
+            self.in_flight -= 1
+
+    @asyncio.coroutine
+    def start(self):
+        self._handler = self.app.make_handler(loop=self.loop)
+        self._server = yield from self.loop.create_server(
+            self._handler, self.host, self.port
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    @asyncio.coroutine
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+            yield from self._server.wait_closed()
+            yield from self.app.shutdown()
+            yield from self._handler.shutdown(1.0)
+            yield from self.app.cleanup()
+        self._server = None
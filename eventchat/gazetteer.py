@@ -0,0 +1,134 @@
+import os
+import re
+import logging
+import ujson
+
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# russian noun/adjective endings, longest first: `москве` -> `москв`,
+# `нижнем новгороде` -> `нижн новгород`, `казани` -> `казан`
+ENDINGS = (
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ом', 'ем',
+    'ах', 'ях', 'ам', 'ям',
+    'ы', 'и', 'а', 'я', 'у', 'ю', 'е', 'о', 'ь',
+)
+MIN_STEM = 2
+MIN_PREFIX = 4
+WORDS = re.compile(r'[\w]+')
+# prepositions and settlement types: `в Москве`, `г. Казань`
+PREFIXES = re.compile(
+    r'^((в|во|из)\s+)?((г|город|гор|пос|пгт|с|село|дер|д)(\.\s*|\s+))?'
+)
+
+
+def normalize(name):
+    name = (name or '').lower().replace('ё', 'е').strip()
+    name = PREFIXES.sub('', name)
+    return ' '.join(WORDS.findall(name))
+
+
+def stem(word):
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def stem_key(name):
+    return ' '.join(stem(word) for word in normalize(name).split())
+
+
+class Gazetteer:
+    """
+    In-process city lookup built from `vk_cities` data.
+
+    Cities are indexed by normalized name and by stemmed name, so
+    inflected forms from Dialogflow `geo-city` (`в Москве`, `Казани`)
+    resolve without network calls. Sorted stem keys give a prefix
+    index for truncated names. Duplicated names resolve to the city with
+    the smallest VK id (VK numbers big cities first).
+
+    Coordinates live in a json file `{vk_id: [lat, lng]}` built once by
+    `./manage.py runscript build_gazetteer`; cities without coordinates
+    are not matched and callers fall back to the geocoder.
+    """
+
+    def __init__(self, cities=(), coords=None):
+        self.names = {}
+        self.stems = {}
+        self.coords = {}
+        coords = coords or {}
+        for vk_id, name in sorted(cities):
+            point = coords.get(vk_id) or coords.get(str(vk_id))
+            if not point:
+                continue
+            self.coords[vk_id] = (float(point[0]), float(point[1]))
+            self.names.setdefault(normalize(name), vk_id)
+            self.stems.setdefault(stem_key(name), vk_id)
+        self.keys = sorted(self.stems)
+
+    def __len__(self):
+        return len(self.coords)
+
+    @classmethod
+    def from_vk_cities(cls, coords_path=None):
+        from vk_cities.models import City
+
+        cities = City.objects.values_list('vk_id', 'name')
+        return cls(list(cities), cls.load_coords(coords_path))
+
+    @staticmethod
+    def load_coords(path):
+        if not path or not os.path.exists(path):
+            return {}
+        try:
+            with open(path) as f:
+                return ujson.load(f)
+        except (IOError, ValueError) as e:
+            logger.warning('skip broken gazetteer %s: %r', path, e)
+            return {}
+
+    def prefix(self, key, limit=10):
+        """
+        Return VK ids of cities which stem key starts with `key`.
+        """
+        result = []
+        index = bisect_left(self.keys, key)
+        while index < len(self.keys) and len(result) < limit:
+            if not self.keys[index].startswith(key):
+                break
+            result.append(self.stems[self.keys[index]])
+            index += 1
+        return result
+
+    def resolve(self, name):
+        """
+        Return VK id of city matched by `name` or `None`.
+        """
+        vk_id = self.names.get(normalize(name))
+        if vk_id is not None:
+            return vk_id
+
+        key = stem_key(name)
+        if not key:
+            return None
+        vk_id = self.stems.get(key)
+        if vk_id is not None:
+            return vk_id
+
+        if len(key) >= MIN_PREFIX:
+            candidates = self.prefix(key, limit=2)
+            if len(candidates) == 1:
+                return candidates[0]
+        return None
+
+    def lookup(self, name):
+        """
+        Return `(lat, lng)` of city matched by `name` or `None`.
+        """
+        vk_id = self.resolve(name)
+        if vk_id is not None:
+            return self.coords[vk_id]
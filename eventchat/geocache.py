@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+import asyncio
+import ujson
+
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+
+class GeocodeCache:
+    """
+    In-memory LRU cache of geocoder answers with TTL and on-disk
+    persistence. Values are `(lat, lng)` tuples; unknown places are
+    cached as `None` with a shorter `negative_ttl`.
+
+    Misses are resolved in the default executor, serialized and spaced
+    by `min_interval` seconds (Nominatim allows ~1 request per second),
+    concurrent lookups of the same name share one request. New answers
+    are written to disk at most once per `save_delay` seconds, in the
+    executor too.
+    """
+
+    def __init__(self, geocoder, path=None, maxsize=1024, ttl=30 * DAY,
+                 negative_ttl=DAY, min_interval=1.0, save_delay=5.0,
+                 loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.geocoder = geocoder
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.min_interval = min_interval
+        self.save_delay = save_delay
+        self.data = OrderedDict()
+        self.pending = {}
+        self.hits = self.misses = 0
+        self._lock = asyncio.Lock(loop=self.loop)
+        self._last_request = 0
+        self._save_handle = None
+        self.load()
+
+    @staticmethod
+    def normalize(name):
+        return ' '.join((name or '').lower().replace('ё', 'е').split())
+
+    def get(self, name):
+        """
+        Return `(found, coords)` pair, `coords` may be cached `None`.
+        """
+        key = self.normalize(name)
+        item = self.data.get(key)
+        if item is None:
+            return False, None
+        expires, coords = item
+        if expires < time.time():
+            del self.data[key]
+            return False, None
+        self.data.move_to_end(key)
+        return True, coords
+
+    def set(self, name, coords):
+        key = self.normalize(name)
+        ttl = self.ttl if coords else self.negative_ttl
+        self.data[key] = (time.time() + ttl, coords)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    @asyncio.coroutine
+    def geocode(self, name):
+        key = self.normalize(name)
+        if not key:
+            return None
+        found, coords = self.get(key)
+        if found:
+            self.hits += 1
+            return coords
+
+        self.misses += 1
+        future = self.pending.get(key)
+        if future is None:
+            future = self.pending[key] = self.loop.create_task(
+                self._resolve(key)
+            )
+            future.add_done_callback(lambda f: self.pending.pop(key, None))
+        coords = yield from asyncio.shield(future, loop=self.loop)
+        return coords
+
+    @asyncio.coroutine
+    def _resolve(self, key):
+        with (yield from self._lock):
+            delay = self._last_request + self.min_interval - time.time()
+            if delay > 0:
+                yield from asyncio.sleep(delay, loop=self.loop)
+            try:
+                location = yield from self.loop.run_in_executor(
+                    None, self.geocoder.geocode, key
+                )
+            except Exception as e:
+                # don't cache network errors, next call will try again
+                logger.warning('geocode %r failed: %r', key, e)
+                return None
+            finally:
+                self._last_request = time.time()
+
+        coords = None
+        if location:
+            coords = (float(location.latitude), float(location.longitude))
+        self.set(key, coords)
+        self.schedule_save()
+        return coords
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                items = ujson.load(f)
+        except (IOError, ValueError) as e:
+            logger.warning('skip broken geocode cache %s: %r', self.path, e)
+            return
+        now = time.time()
+        for key, expires, coords in items:
+            if expires > now:
+                self.data[key] = (expires, tuple(coords) if coords else None)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def schedule_save(self):
+        if self.path and self._save_handle is None:
+            self._save_handle = self.loop.call_later(
+                self.save_delay, self.flush
+            )
+
+    def flush(self):
+        """
+        Write cache in the executor, return the future.
+        """
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        # snapshot on the loop, `data` keeps changing while writing
+        items = self.dump()
+        return self.loop.run_in_executor(None, self.write, items)
+
+    def dump(self):
+        return [
+            [key, expires, coords]
+            for key, (expires, coords) in self.data.items()
+        ]
+
+    def save(self):
+        """
+        Write cache right now, blocking.
+        """
+        self.write(self.dump())
+
+    def write(self, items):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = '%s.tmp' % self.path
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                ujson.dump(items, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            logger.warning('geocode cache %s not saved: %r', self.path, e)
@@ -0,0 +1,113 @@
+import logging
+import asyncio
+import functools
+
+from elasticsearch_dsl import Q
+
+from services.elastic.models import Event
+
+from .uploads import PhotoUploader
+
+logger = logging.getLogger(__name__)
+
+
+def pending_photos():
+    """
+    Upcoming events (same date window as `Event.search_events`) with an
+    image but without uploaded `attach`.
+    """
+    search = Event.search()
+    search = search.exclude('term', deleted=True)
+    search = search.filter(
+        'range',
+        **{'schedules.end_date': {
+            'lte': 'now+1y/d',
+            'gte': 'now/d'
+        }}
+    )
+    search = search.filter('exists', field='image')
+    # `attach` is null after `VKChat.forget_photo`, older
+    # invalidated photos were stored as empty string
+    search = search.filter(Q(
+        'bool',
+        should=[
+            ~Q('exists', field='attach'),
+            Q('term', **{'attach.keyword': ''}),
+        ],
+        minimum_should_match=1
+    ))
+    search = search.source(['image'])
+    return search
+
+
+class PhotoPreloader:
+    """
+    Upload photos of upcoming events ahead of time, so `VKChat`
+    finds ready `attach` ids and almost never uploads on chat path.
+
+    Events are uploaded in batches of `batch_size` concurrent uploads
+    with `delay` seconds between batches to stay within VK limits.
+    Attach ids are written back with partial updates. ES scan and
+    updates run in executor, so `VKChat` runs it in its own loop, on
+    its `VKScheduler` with `priority=BACKGROUND`: one VK limit for
+    both, replies to users go first.
+    """
+
+    def __init__(self, vk, peer_id, batch_size=5, delay=1.0, priority=None,
+                 loop=None, **uploader_options):
+        self.loop = loop or asyncio.get_event_loop()
+        self.peer_id = peer_id
+        self.batch_size = batch_size
+        self.delay = delay
+        if priority is not None:
+            # `VKScheduler` call with forced priority
+            vk = functools.partial(vk, priority=priority)
+        self.uploader = PhotoUploader(vk, loop=self.loop, **uploader_options)
+
+    @asyncio.coroutine
+    def upload_batch(self, events):
+        attachments = yield from self.uploader.upload_many(
+            [event.image for event in events],
+            self.peer_id
+        )
+        done = 0
+        for event, attach in zip(events, attachments):
+            if attach:
+                yield from self.loop.run_in_executor(
+                    None, functools.partial(event.update, attach=attach)
+                )
+                done += 1
+        return done
+
+    @asyncio.coroutine
+    def run_once(self):
+        uploaded = total = 0
+        batch = []
+        # only `image` of pending events, scanned off the loop
+        events = yield from self.loop.run_in_executor(
+            None, lambda: list(pending_photos().scan())
+        )
+        for event in events:
+            if not isinstance(event.image, str) or \
+                    not event.image.startswith('http'):
+                continue
+            batch.append(event)
+            if len(batch) >= self.batch_size:
+                uploaded += yield from self.upload_batch(batch)
+                total += len(batch)
+                batch = []
+                yield from asyncio.sleep(self.delay, loop=self.loop)
+        if batch:
+            uploaded += yield from self.upload_batch(batch)
+            total += len(batch)
+        logger.debug('preuploaded %s of %s photos', uploaded, total)
+        return uploaded
+
+    @asyncio.coroutine
+    def run_forever(self, interval=600):
+        while True:
+            try:
+                yield from self.run_once()
+            except Exception:
+                logger.exception('photo preupload failed')
+            yield from asyncio.sleep(interval, loop=self.loop)
@@ -0,0 +1,178 @@
+import time
+import heapq
+import logging
+import asyncio
+
+from itertools import count
+
+logger = logging.getLogger(__name__)
+
+# lower value goes first
+REPLY = 0
+UPLOAD = 1
+BACKGROUND = 2
+
+METHOD_PRIORITIES = {
+    'messages.send': REPLY,
+    'execute': REPLY,
+    'photos.getMessagesUploadServer': UPLOAD,
+    'photos.saveMessagesPhoto': UPLOAD,
+    'groups.get': BACKGROUND,
+}
+
+# VK error `Too many requests per second`
+TOO_MANY_REQUESTS = 6
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, up to `capacity` tokens saved for bursts.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def consume(self, tokens=1):
+        """
+        Take `tokens` if available and return 0, otherwise return
+        seconds to wait before next try.
+        """
+        self.refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0
+        return (tokens - self.tokens) / self.rate
+
+
+class Stats:
+
+    def __init__(self):
+        self.calls = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def add(self, wait):
+        self.calls += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'wait_avg': self.wait_total / self.calls if self.calls else 0,
+            'wait_max': self.wait_max,
+        }
+
+
+class VKScheduler:
+    """
+    Token-bucket throttle with priority queue in front of `aiovk.API`.
+
+    Called like `aiovk.API`: `yield from vk('messages.send', **params)`.
+    Every call waits for a token; when calls queue up, replies to users
+    go before photo uploads and background work (see `METHOD_PRIORITIES`,
+    `priority` argument forces one priority for all calls). Calls that
+    still hit `Too many requests per second` are queued again with
+    backoff, up to `retries` times.
+
+    `rate` is 20 for community tokens and 3 for user tokens.
+    """
+
+    def __init__(self, api, rate=20, capacity=None, retries=3, backoff=0.5,
+                 priority=None, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.api = api
+        self.bucket = TokenBucket(rate, capacity)
+        self.retries = retries
+        self.backoff = backoff
+        self.priority = priority
+        self.queue = []
+        self.counter = count()
+        self.stats = {}
+        self.throttled = 0
+        self._wakeup = asyncio.Event(loop=self.loop)
+        self._worker = None
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def metrics(self):
+        return {
+            'depth': self.depth,
+            'throttled': self.throttled,
+            'priorities': {
+                priority: stats.as_dict()
+                for priority, stats in self.stats.items()
+            },
+        }
+
+    def get_priority(self, method):
+        if self.priority is not None:
+            return self.priority
+        return METHOD_PRIORITIES.get(method, BACKGROUND)
+
+    @asyncio.coroutine
+    def acquire(self, priority):
+        if self._worker is None or self._worker.done():
+            self._worker = self.loop.create_task(self._grant())
+        future = self.loop.create_future()
+        started = self.loop.time()
+        heapq.heappush(self.queue, (priority, next(self.counter), future))
+        self._wakeup.set()
+        yield from future
+        self.stats.setdefault(priority, Stats()).add(
+            self.loop.time() - started
+        )
+
+    @asyncio.coroutine
+    def __call__(self, method, priority=None, **params):
+        if priority is None:
+            priority = self.get_priority(method)
+        attempt = 0
+        while True:
+            yield from self.acquire(priority)
+            try:
+                result = yield from self.api(method, **params)
+                return result
+            except Exception as e:
+                code = getattr(e, 'error_code', None)
+                if code != TOO_MANY_REQUESTS or attempt >= self.retries:
+                    raise
+                attempt += 1
+                self.throttled += 1
+                logger.debug('%s throttled by VK, retry %s', method, attempt)
+                yield from asyncio.sleep(
+                    self.backoff * attempt,
+                    loop=self.loop
+                )
+
+    @asyncio.coroutine
+    def _grant(self):
+        while True:
+            if not self.queue:
+                self._wakeup.clear()
+                yield from self._wakeup.wait()
+                continue
+            if self.queue[0][2].done():
+                # caller gone, don't spend a token on it
+                heapq.heappop(self.queue)
+                continue
+            wait = self.bucket.consume()
+            if wait:
+                yield from asyncio.sleep(wait, loop=self.loop)
+                continue
+            _, _, future = heapq.heappop(self.queue)
+            future.set_result(None)
@@ -0,0 +1,84 @@
+import json
+import timeit
+import logging
+import ujson
+
+from elasticsearch_dsl.connections import connections
+
+from services.elastic.models import Event
+from services.elastic.records import RawResponse, FILTER_PATH
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def touch_event(event):
+    # fields read by `VKChat.send_card`
+    dates = event.dates[0] if event.dates else {}
+    return (
+        event.title, event.description, event.image,
+        getattr(event, 'attach', None),
+        event.place.title, event.place.lat, event.place.lng,
+        getattr(dates, 'start_date', None), getattr(dates, 'end_date', None),
+    )
+
+
+def touch_card(card):
+    return (
+        card.title, card.description, card.image, card.attach,
+        card.place_title, card.lat, card.lng,
+        card.start_date, card.end_date,
+    )
+
+
+def report(name, seconds, number):
+    print('%-32s %8.3f ms' % (name, seconds * 1000.0 / number))
+
+
+def run(*args):
+    """
+    Compare `Event` hydration with raw `EventCard` records.
+
+    Example: `./manage.py runscript bench_search --script-args [number] [q]`
+    """
+    number = int(args[0]) if args else 100
+    q = args[1] if len(args) > 1 else ''
+    params = {'q': q, 'limit_to': 18, 'cache': False}
+
+    # round trip: query + decode + field access
+    for projection in ('full', 'chat_card'):
+        seconds = timeit.timeit(
+            lambda: [touch_event(e) for e in Event.search_events(
+                projection=projection, **params)],
+            number=number
+        )
+        report('hydrated %s' % projection, seconds, number)
+        seconds = timeit.timeit(
+            lambda: [touch_card(c) for c in Event.search_events(
+                projection=projection, raw=True, **params)],
+            number=number
+        )
+        report('raw %s' % projection, seconds, number)
+
+    # client side only: decode same response body
+    search = Event.search_events(observable=True, projection='chat_card', **params)
+    connection = connections.get_connection().transport.get_connection()
+    url = '/%s/%s/_search' % (Event._doc_type.index, Event._doc_type.name)
+    body = ujson.dumps(search.to_dict())
+    _, _, full = connection.perform_request('POST', url, {}, body)
+    _, _, filtered = connection.perform_request(
+        'POST', url, {'filter_path': FILTER_PATH}, body
+    )
+    print('response bytes: %s full, %s filtered' % (len(full), len(filtered)))
+
+    seconds = timeit.timeit(
+        lambda: [touch_event(e) for e in search._response_class(
+            search, json.loads(full))],
+        number=number
+    )
+    report('decode hydrated', seconds, number)
+    seconds = timeit.timeit(
+        lambda: [touch_card(c) for c in RawResponse.loads(filtered)],
+        number=number
+    )
+    report('decode raw', seconds, number)
@@ -0,0 +1,87 @@
+import random
+import timeit
+import logging
+
+from datetime import datetime, timedelta
+
+from services.afi.schema import EventSerializer
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+CATEGORIES = ('cinema', 'concert', 'theatre', 'exhibition', 'club')
+
+
+def make_company(number):
+    return {
+        'company-id': 'company%s' % number,
+        'name': {'@lang': 'ru', '#text': 'Площадка %s' % number},
+        'address': {'@lang': 'ru', '#text': 'ул. Тверская, %s' % number},
+        'city': 'Москва',
+        'coordinates': {'lat': '55.%04d' % number, 'lon': '37.%04d' % number},
+        'email': 'info%s@example.com' % number,
+        'add-url': 'http://example.com/%s' % number,
+        'phone': [{'number': '+7 495 000-00-%02d' % (number % 100)}],
+    }
+
+
+def make_creation(number, company, now):
+    begin = now + timedelta(days=random.randint(-30, 60), hours=19)
+    return {
+        'creation-id': '%s%s' % (random.choice(CATEGORIES), number),
+        'name': {'@lang': 'ru', '#text': 'Событие номер %s' % number},
+        'description': {'#text': 'Описание события %s. ' % number * 5},
+        'editorial-comment': {},
+        'widget-description': {},
+        'synopsis': {'#text': 'Синопсис %s' % number},
+        'main-photo': 'http://example.com/photo/%s.jpg' % number,
+        'begin': begin.strftime('%Y-%m-%dT%H:%M:%S'),
+        'end': (begin + timedelta(hours=2)).strftime('%Y-%m-%dT%H:%M:%S'),
+        'rating': str(random.randint(0, 10)),
+        'status': 'от 500 руб.',
+        'company-id': company['company-id'],
+        'place': company,
+    }
+
+
+def without_date_added(data):
+    # `date_added` is `datetime.now()`, differs between calls
+    return {key: value for key, value in data.items() if key != 'date_added'}
+
+
+def report(name, seconds, count):
+    print('%-16s %8.3f s  %8.1f us/item' % (
+        name, seconds, seconds * 1000000.0 / count
+    ))
+
+
+def run(*args):
+    """
+    Compare DRF `.data` with compiled `fast_data` of AFI `EventSerializer`.
+
+    Example: `./manage.py runscript bench_serializers --script-args [count]`
+    """
+    count = int(args[0]) if args else 20000
+    random.seed(0)
+    now = datetime.now()
+    companies = [make_company(number) for number in range(count // 20 or 1)]
+    sample = [
+        make_creation(number, random.choice(companies), now)
+        for number in range(count)
+    ]
+
+    mismatched = sum(
+        without_date_added(EventSerializer(obj).data) !=
+        without_date_added(EventSerializer.fast_data(obj))
+        for obj in sample
+    )
+    print('%s items, %s mismatched' % (count, mismatched))
+
+    seconds = timeit.timeit(
+        lambda: [EventSerializer(obj).data for obj in sample], number=1
+    )
+    report('drf .data', seconds, count)
+    seconds = timeit.timeit(
+        lambda: [EventSerializer.fast_data(obj) for obj in sample], number=1
+    )
+    report('fast_data', seconds, count)
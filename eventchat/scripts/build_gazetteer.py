@@ -0,0 +1,60 @@
+import os
+import time
+import logging
+import ujson
+
+from django.conf import settings
+from geopy.geocoders import Nominatim
+
+from vk_cities.models import City
+from eventchat.gazetteer import Gazetteer
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def save(coords, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as f:
+        ujson.dump(coords, f)
+    os.replace(tmp_path, path)
+
+
+def run(*args):
+    """
+    Geocode `vk_cities` cities once and store coordinates for `Gazetteer`.
+    Already known cities are skipped, so the script can be restarted.
+
+    Example: `./manage.py runscript build_gazetteer --script-args <limit>`
+    """
+    path = settings.GAZETTEER['coords_path']
+    limit = int(args[0]) if args else None
+    coords = Gazetteer.load_coords(path)
+    geolocator = Nominatim()
+
+    cities = City.objects.select_related('region').order_by('vk_id')
+    done = 0
+    for city in cities.iterator():
+        if str(city.vk_id) in coords:
+            continue
+        if limit is not None and done >= limit:
+            break
+        query = '%s, %s' % (city.name, city.region.name)
+        try:
+            location = geolocator.geocode(query)
+        except Exception as e:
+            logger.warning('geocode %s failed: %r', query, e)
+            location = None
+        # keep unknown cities too, don't ask Nominatim twice
+        coords[str(city.vk_id)] = (
+            [location.latitude, location.longitude] if location else None
+        )
+        done += 1
+        if done % 50 == 0:
+            save(coords, path)
+            logger.debug('geocoded %s cities', done)
+        # Nominatim usage policy: 1 request per second
+        time.sleep(1)
+    save(coords, path)
+    logger.debug('gazetteer has %s cities', len(coords))
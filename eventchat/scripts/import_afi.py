@@ -0,0 +1,23 @@
+import logging
+
+from services.afi.feed import AfiFeed
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def run(*args):
+    """
+    Stream AFI XML feed into `place-index` and `event-index`.
+
+    Example: `./manage.py runscript import_afi --script-args <path> [chunk_size] [workers]`
+    """
+    if not args:
+        logger.error('AFI feed path is required')
+        return
+    chunk_size = int(args[1]) if len(args) > 1 else 500
+    # serialization processes, 0 serializes in this process
+    workers = int(args[2]) if len(args) > 2 else 0
+    feed = AfiFeed(args[0], chunk_size=chunk_size, workers=workers)
+    places, events = feed.run()
+    logger.debug('imported %s places, %s events', places, events)
@@ -0,0 +1,30 @@
+import logging
+
+from services.elastic.cache import invalidate
+from services.elastic.local import get_local_index
+from services.elastic.models import Event
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def run(*args):
+    """
+    Fill `EVENT_LOCAL_SEARCH` index with serialized event documents:
+    from JSON lines file (one `BaseEventSerializer.data` per line),
+    or copy of `event-index` when no file is given.
+
+    Example: `./manage.py runscript load_local_search --script-args <path>`
+    """
+    local_index = get_local_index()
+    if local_index is None:
+        logger.error('EVENT_LOCAL_SEARCH is not set')
+        return
+
+    if args:
+        count = local_index.load_file(args[0])
+    else:
+        # hits keep their `_id`
+        count = local_index.load(Event.scan_sources(Event.search()))
+    invalidate(Event._doc_type.index)
+    logger.debug('loaded %s events into %s', count, local_index.path)
@@ -0,0 +1,52 @@
+import logging
+import asyncio
+import aiovk
+
+from django.conf import settings
+
+from eventchat.preupload import PhotoPreloader
+from eventchat.ratelimit import VKScheduler, BACKGROUND
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def run(*args):
+    """
+    Upload photos of upcoming events to VK before users ask for them.
+    Without `interval` runs once, otherwise repeats every `interval` seconds.
+
+    Running `VKChat` preuploads by itself (`PHOTO_PRELOADER_INTERVAL`),
+    this script is for backfills while the bot is stopped: it takes
+    the whole `VK_RATE_LIMIT` of the community token.
+
+    Example: `./manage.py runscript preupload_photos --script-args <peer_id> <vk_token> [interval]`
+    """
+    peer_id = args[0]
+    vk_token = args[1]
+    interval = int(args[2]) if len(args) > 2 else None
+
+    loop = asyncio.get_event_loop()
+    session = aiovk.TokenSession(access_token=vk_token)
+    vk = VKScheduler(
+        aiovk.API(session),
+        priority=BACKGROUND,
+        loop=loop,
+        **getattr(settings, 'VK_RATE_LIMIT', {})
+    )
+    preloader = PhotoPreloader(
+        vk,
+        peer_id,
+        loop=loop,
+        **getattr(settings, 'PHOTO_PRELOADER', {})
+    )
+    logger.debug('preupload event photos')
+    if interval:
+        task = preloader.run_forever(interval)
+    else:
+        task = preloader.run_once()
+    try:
+        loop.run_until_complete(task)
+    finally:
+        loop.run_until_complete(preloader.uploader.close())
+        session.close()
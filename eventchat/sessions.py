@@ -0,0 +1,50 @@
+import time
+
+from collections import OrderedDict
+
+
+class ConversationStore:
+    """
+    Per-user conversation state (last query params, ES `search_after`
+    cursor) for paging with "where-is-party-next".
+
+    Users are kept in access order: idle ones (`idle_ttl` seconds) are
+    evicted from the head on every write, and at most `maxsize` users
+    are stored.
+    """
+
+    def __init__(self, maxsize=10000, idle_ttl=30 * 60):
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self.data = OrderedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, user_id):
+        item = self.data.get(user_id)
+        if item is None:
+            return None
+        seen, state = item
+        if seen + self.idle_ttl < time.time():
+            del self.data[user_id]
+            return None
+        self.data[user_id] = (time.time(), state)
+        self.data.move_to_end(user_id)
+        return state
+
+    def set(self, user_id, **state):
+        self.data[user_id] = (time.time(), state)
+        self.data.move_to_end(user_id)
+        self.evict()
+
+    def delete(self, user_id):
+        self.data.pop(user_id, None)
+
+    def evict(self):
+        deadline = time.time() - self.idle_ttl
+        while self.data:
+            user_id, (seen, _) = next(iter(self.data.items()))
+            if seen >= deadline and len(self.data) <= self.maxsize:
+                break
+            del self.data[user_id]
@@ -1,3 +1,785 @@
-from django.test import TestCase
+import os
+import json
+import math
+import time
+import asyncio
+import tempfile
 
-# Create your tests here.
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+from dateutil.parser import parse
+
+from django.test import SimpleTestCase
+
+from elasticsearch import TransportError
+from elasticsearch.serializer import JSONSerializer
+
+from services.elastic import aio, local, models
+from services.elastic.models import Event
+from services.elastic.hotset import HotSet
+from services.elastic.geocells import (
+    EARTH_RADIUS, GeoCellIndex, cover, distance, geohash
+)
+from services.elastic.mixins import ElasticsearchMixin
+from services.elastic.bulk import BulkIndexer
+from services.schema import BaseEventSerializer, parse_datetime
+from services.elastic.search import EventSearchSpec
+
+from .dialogflow import DialogflowClient, DialogflowError
+from .fake_dialogflow import FakeDialogflowServer, make_answer
+from .geocache import GeocodeCache
+from .dispatcher import UserDispatcher
+from .batching import (
+    ExecuteBatcher, ExecuteError, ExecuteResult, ExecuteSession
+)
+from .vk import VKChat, blames_attachment
+from .sessions import ConversationStore
+from .preupload import PhotoPreloader
+from .ratelimit import BACKGROUND
+
+
+class AsyncTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+
+class DialogflowClientTest(AsyncTestCase):
+
+    @asyncio.coroutine
+    def query(self, server, *messages, **options):
+        yield from server.start()
+        client = DialogflowClient(
+            'token', base_url=server.base_url, loop=self.loop, **options
+        )
+        try:
+            answers = yield from asyncio.gather(
+                *[client.query(number, message)
+                  for number, message in enumerate(messages)],
+                loop=self.loop
+            )
+        finally:
+            yield from client.close()
+            yield from server.stop()
+        return answers
+
+    def test_answer(self):
+        answer = make_answer('hi', action='smalltalk.greetings', speech='hello')
+        server = FakeDialogflowServer(answers={'hi': answer}, loop=self.loop)
+        answers = self.run_async(self.query(server, 'hi', 'bye'))
+        self.assertEqual(answers[0], answer)
+        self.assertEqual(answers[1]['result']['action'], 'input.unknown')
+        self.assertEqual(server.requests[0]['lang'], 'ru')
+
+    def test_concurrent_queries(self):
+        server = FakeDialogflowServer(delay=0.2, loop=self.loop)
+        started = time.time()
+        answers = self.run_async(self.query(server, *['hi'] * 20))
+        self.assertEqual(len(answers), 20)
+        self.assertEqual(server.max_in_flight, 20)
+        # all in flight at once, not one after another
+        self.assertLess(time.time() - started, 1.0)
+
+    def test_pool_size_limits_in_flight(self):
+        server = FakeDialogflowServer(delay=0.05, loop=self.loop)
+        self.run_async(self.query(server, *['hi'] * 10, pool_size=3))
+        self.assertLessEqual(server.max_in_flight, 3)
+
+    def test_retry(self):
+        server = FakeDialogflowServer(fail_times=2, loop=self.loop)
+        answers = self.run_async(
+            self.query(server, 'hi', retries=2, backoff=0.01)
+        )
+        self.assertEqual(answers[0]['result']['resolvedQuery'], 'hi')
+        self.assertEqual(len(server.requests), 3)
+
+    def test_retries_exhausted(self):
+        server = FakeDialogflowServer(fail_times=5, loop=self.loop)
+        with self.assertRaises(DialogflowError):
+            self.run_async(self.query(server, 'hi', retries=1, backoff=0.01))
+        self.assertEqual(len(server.requests), 2)
+
+    def test_timeout(self):
+        server = FakeDialogflowServer(delay=0.5, loop=self.loop)
+        with self.assertRaises(DialogflowError):
+            self.run_async(self.query(server, 'hi', timeout=0.1, retries=1,
+                                      backoff=0.01))
+        # both attempts gave up before fake server answered
+        self.assertEqual(len(server.requests), 2)
+
+
+class UserDispatcherTest(AsyncTestCase):
+
+    def test_order_per_user(self):
+        handled = []
+        busy = set()
+        overlaps = []
+
+        @asyncio.coroutine
+        def handler(user_id, message):
+            # other users handled meanwhile, never the same one
+            overlaps.append(set(busy))
+            self.assertNotIn(user_id, busy)
+            busy.add(user_id)
+            try:
+                # first messages are slow, later ones would overtake them
+                delay = 0.05 if message.endswith('1') else 0.001
+                yield from asyncio.sleep(delay, loop=self.loop)
+                if message == 'b2':
+                    raise ValueError('broken handler')
+                handled.append((user_id, message))
+            finally:
+                busy.discard(user_id)
+
+        dispatcher = UserDispatcher(handler, concurrency=4, loop=self.loop)
+        for user_id, message in [('a', 'a1'), ('b', 'b1'), ('a', 'a2'),
+                                 ('b', 'b2'), ('a', 'a3'), ('b', 'b3')]:
+            dispatcher.put(user_id, message)
+
+        @asyncio.coroutine
+        def scenario():
+            dispatcher.start()
+            yield from asyncio.wait_for(dispatcher.join(), 2, loop=self.loop)
+            yield from dispatcher.stop()
+
+        self.run_async(scenario())
+        by_user = lambda user: [m for u, m in handled if u == user]
+        self.assertEqual(by_user('a'), ['a1', 'a2', 'a3'])
+        # failed message doesn't stop the user's queue
+        self.assertEqual(by_user('b'), ['b1', 'b3'])
+        # users ran concurrently
+        self.assertIn({'a'}, overlaps)
+        self.assertEqual(dispatcher.pending, 0)
+
+
+Location = namedtuple('Location', 'latitude longitude')
+
+
+class FakeGeocoder(object):
+
+    def __init__(self):
+        self.queries = []
+
+    def geocode(self, query):
+        self.queries.append(query)
+        return Location(55.75, 37.61) if query == 'москва' else None
+
+
+class GeocodeCacheTest(AsyncTestCase):
+
+    def test_misses_saved_once(self):
+        path = os.path.join(tempfile.mkdtemp(), 'data', 'geocode.json')
+        geocoder = FakeGeocoder()
+        cache = GeocodeCache(geocoder, path=path, min_interval=0,
+                             save_delay=0.1, loop=self.loop)
+        writes = []
+        write = cache.write
+        cache.write = lambda items: writes.append(items) or write(items)
+
+        @asyncio.coroutine
+        def scenario():
+            coords = yield from asyncio.gather(
+                cache.geocode('Москва'), cache.geocode('москва '),
+                cache.geocode('Нигде'), loop=self.loop
+            )
+            self.assertFalse(writes)
+            yield from asyncio.sleep(0.3, loop=self.loop)
+            return coords
+
+        coords = self.run_async(scenario())
+        self.assertEqual(coords, [(55.75, 37.61), (55.75, 37.61), None])
+        self.assertEqual(sorted(geocoder.queries), ['москва', 'нигде'])
+        self.assertEqual(len(writes), 1)
+
+        loaded = GeocodeCache(geocoder, path=path, loop=self.loop)
+        self.assertEqual(loaded.get('Москва'), (True, (55.75, 37.61)))
+
+
+class FakeVK(object):
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    @asyncio.coroutine
+    def __call__(self, method, **params):
+        self.calls.append((method, params))
+        return self.result
+
+
+Card = namedtuple('Card', 'id lat lng text sort attach image')
+
+
+class Hits(list):
+    total = property(len)
+
+
+class SendAnswerTest(AsyncTestCase):
+
+    def make_chat(self, vk, events=None, error=None):
+        chat = VKChat.__new__(VKChat)
+        chat.loop = self.loop
+        chat.peer_id = 1
+        chat.batcher = ExecuteBatcher(vk, loop=self.loop)
+        chat.conversations = ConversationStore()
+
+        @asyncio.coroutine
+        def search_events(**kwargs):
+            if error:
+                raise error
+            return Hits(events)
+
+        @asyncio.coroutine
+        def upload_photos(user_id, events):
+            return ['photo%s' % event.id for event in events]
+
+        chat.search_events = search_events
+        chat.upload_photos = upload_photos
+        return chat
+
+    def answer(self, chat):
+        return chat.send_answer(7, {'result': {
+            'action': 'where-is-party', 'parameters': {'geo-city': 'Moscow'},
+            'fulfillment': {'speech': 'Look'}, 'contexts': [],
+        }})
+
+    def test_one_execute(self):
+        events = [
+            Card(number, None, None, 'event %s' % number, [number], '', '')
+            for number in range(5)
+        ]
+        vk = FakeVK([1] * 6)
+        self.run_async(self.answer(self.make_chat(vk, events)))
+        self.assertEqual(len(vk.calls), 1)
+        method, params = vk.calls[0]
+        self.assertEqual(method, 'execute')
+        # welcome first, then cards in order
+        code = params['code']
+        positions = [code.index('Look')] + [
+            code.index('event %s' % number) for number in range(5)
+        ]
+        self.assertEqual(positions, sorted(positions))
+
+    def test_welcome_when_search_fails(self):
+        vk = FakeVK(1)
+        chat = self.make_chat(vk, error=ValueError('ES is down'))
+        with self.assertRaises(ValueError):
+            self.run_async(self.answer(chat))
+        self.assertEqual(len(vk.calls), 1)
+        self.assertEqual(vk.calls[0][0], 'messages.send')
+        self.assertEqual(vk.calls[0][1]['message'], 'Look')
+
+
+class PhotoPreloaderTest(AsyncTestCase):
+
+    def test_background_priority(self):
+        vk = FakeVK({'upload_url': 'http://upload'})
+        preloader = PhotoPreloader(vk, 1, priority=BACKGROUND, loop=self.loop)
+        self.run_async(preloader.uploader.vk('photos.getMessagesUploadServer'))
+        self.assertEqual(vk.calls, [
+            ('photos.getMessagesUploadServer', {'priority': BACKGROUND})
+        ])
+
+
+class ExecuteBatcherTest(AsyncTestCase):
+
+    @asyncio.coroutine
+    def call_all(self, batcher, count):
+        # tasks, not coroutines: `gather` would start those in any order
+        results = yield from asyncio.gather(*[
+            self.loop.create_task(
+                batcher.call('messages.send', peer_id=number)
+            )
+            for number in range(count)
+        ], loop=self.loop, return_exceptions=True)
+        return results
+
+    def test_batched(self):
+        vk = FakeVK([1, False, 3])
+        batcher = ExecuteBatcher(vk, loop=self.loop)
+        results = self.run_async(self.call_all(batcher, 3))
+        self.assertEqual(len(vk.calls), 1)
+        self.assertEqual(vk.calls[0][0], 'execute')
+        self.assertEqual(results[0], 1)
+        self.assertIsInstance(results[1], ExecuteError)
+        self.assertEqual(results[2], 3)
+
+    def test_error_codes(self):
+        vk = FakeVK(ExecuteResult([False, 2, False], errors=[
+            {'method': 'messages.send', 'error_code': 901,
+             'error_msg': "Can't send messages for users without permission"},
+            {'method': 'messages.send', 'error_code': 100,
+             'error_msg': 'One of the parameters specified was missing or '
+                          'invalid: attachment is invalid'},
+        ]))
+        batcher = ExecuteBatcher(vk, loop=self.loop)
+        results = self.run_async(self.call_all(batcher, 3))
+        self.assertEqual(results[0].error_code, 901)
+        self.assertFalse(blames_attachment(results[0]))
+        self.assertEqual(results[1], 2)
+        self.assertEqual(results[2].error_code, 100)
+        self.assertTrue(blames_attachment(results[2]))
+        # no code, e.g. plain `TokenSession`: photo is not blamed
+        self.assertFalse(blames_attachment(ExecuteError('failed')))
+
+    def test_session_keeps_errors(self):
+        errors = [{'method': 'messages.send', 'error_code': 901,
+                   'error_msg': 'no permission'}]
+        session = ExecuteSession(access_token='token', driver=mock.Mock())
+
+        @asyncio.coroutine
+        def json(url, params, timeout):
+            return {'response': [False], 'execute_errors': errors}
+
+        session.driver.json = json
+        result = self.run_async(
+            session.send_api_request('execute', {'code': 'return [];'})
+        )
+        self.assertEqual(result, [False])
+        self.assertEqual(result.errors, errors)
+
+    def test_short_result(self):
+        batcher = ExecuteBatcher(FakeVK([1]), loop=self.loop)
+        results = self.run_async(asyncio.wait_for(
+            self.call_all(batcher, 3), 1, loop=self.loop
+        ))
+        self.assertEqual(results[0], 1)
+        self.assertIsInstance(results[1], ExecuteError)
+        self.assertIsInstance(results[2], ExecuteError)
+
+    def test_not_list_result(self):
+        batcher = ExecuteBatcher(FakeVK(1), loop=self.loop)
+        results = self.run_async(asyncio.wait_for(
+            self.call_all(batcher, 2), 1, loop=self.loop
+        ))
+        self.assertTrue(all(isinstance(r, ExecuteError) for r in results))
+
+
+class HotSetTest(SimpleTestCase):
+
+    def test_events_without_place(self):
+        day = (date.today() + timedelta(days=1)).isoformat()
+        schedules = [{'start_date': '%sT19:00:00' % day}]
+        hotset = HotSet()
+        hotset.refresh([
+            ('near', {'place': {'lat': 55.75, 'lng': 37.61},
+                      'schedules': schedules}),
+            ('online', {'schedules': schedules}),
+        ])
+
+        spec = EventSearchSpec.from_kwargs(start_date=day)
+        self.assertTrue(hotset.can_answer(spec))
+        total, found = hotset.search(spec)
+        self.assertEqual(total, 2)
+
+        spec = EventSearchSpec.from_kwargs(
+            start_date=day, lat=55.75, lng=37.61, radius=5000
+        )
+        total, found = hotset.search(spec)
+        self.assertEqual([doc_id for doc_id, _ in found], ['near'])
+
+        # unchanged row without coordinates keeps arrays as they are
+        table = hotset.table
+        hotset.update([('online', {'schedules': schedules})])
+        self.assertIs(hotset.table, table)
+
+
+def offset(lat, lng, north, east):
+    """
+    Point `north` and `east` meters away.
+    """
+    dlat = math.degrees(north / EARTH_RADIUS)
+    dlng = math.degrees(east / EARTH_RADIUS) / math.cos(math.radians(lat))
+    return lat + dlat, lng + dlng
+
+
+def make_source(day, lat=55.75, lng=37.61, category=None, hour=19):
+    day = day.isoformat()
+    source = {
+        'place': {'lat': lat, 'lng': lng},
+        'next_start': '%sT%02d:00:00' % (day, hour),
+        'schedules': [{'start_date': day, 'end_date': day}],
+    }
+    if category:
+        source['category'] = {'slug': category}
+    return source
+
+
+class GeoCellIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        self.day = date.today() + timedelta(days=10)
+        self.geocells = GeoCellIndex()
+
+    def search(self, **kwargs):
+        kwargs = dict({'lat': 55.75, 'lng': 37.61, 'radius': 5000}, **kwargs)
+        total, found = self.geocells.search(
+            EventSearchSpec.from_kwargs(**kwargs)
+        )
+        return [doc_id for doc_id, _ in found]
+
+    def test_category(self):
+        self.geocells.refresh([
+            ('film', make_source(self.day, category='cinema')),
+            ('party', make_source(self.day, category='club')),
+        ])
+        self.assertEqual(self.search(category_slug='cinema'), ['film'])
+        self.assertEqual(self.search(category_slug='theatre'), [])
+        self.assertEqual(sorted(self.search()), ['film', 'party'])
+
+    def test_cover(self):
+        for lat, lng, radius in [(55.75, 37.61, 5000), (59.93, 30.31, 300),
+                                 (0.01, -0.01, 20000)]:
+            cells = cover(lat, lng, radius)
+            for step in range(36):
+                angle = math.radians(step * 10)
+                point = offset(lat, lng, radius * 0.99 * math.cos(angle),
+                               radius * 0.99 * math.sin(angle))
+                self.assertLess(distance(lat, lng, *point), radius)
+                self.assertIn(geohash(*point), cells)
+
+    def test_distance(self):
+        self.geocells.refresh([
+            ('near', make_source(self.day, *offset(55.75, 37.61, 4000, 0))),
+            ('far', make_source(self.day, *offset(55.75, 37.61, 0, 6000))),
+        ])
+        self.assertEqual(self.search(), ['near'])
+        self.assertEqual(sorted(self.search(radius=7000)), ['far', 'near'])
+
+    def test_dates(self):
+        today = date.today()
+        self.geocells.refresh([
+            ('past', make_source(today - timedelta(days=3))),
+            ('soon', make_source(today + timedelta(days=2))),
+            ('later', make_source(today + timedelta(days=20))),
+        ])
+        # open dates: not ended yet
+        self.assertEqual(self.search(), ['soon', 'later'])
+        day = today + timedelta(days=2)
+        self.assertEqual(self.search(start_date=day.isoformat()), ['soon'])
+        self.assertEqual(self.search(
+            start_date=today.isoformat(),
+            end_date=(today + timedelta(days=30)).isoformat()
+        ), ['soon', 'later'])
+        day = today - timedelta(days=3)
+        self.assertEqual(self.search(start_date=day.isoformat()), ['past'])
+
+    def test_search_after(self):
+        self.geocells.refresh([
+            ('event%s' % hour, make_source(self.day, hour=hour))
+            for hour in range(10, 15)
+        ])
+        spec = EventSearchSpec.from_kwargs(
+            lat=55.75, lng=37.61, radius=5000, limit_to=2
+        )
+        total, page = self.geocells.search(spec)
+        self.assertEqual(total, 5)
+        self.assertEqual([doc_id for doc_id, _ in page], ['event10', 'event11'])
+
+        spec.search_after = page[-1][1]
+        total, page = self.geocells.search(spec)
+        self.assertEqual([doc_id for doc_id, _ in page], ['event12', 'event13'])
+
+    def test_discard(self):
+        self.geocells.refresh([('event', make_source(self.day))])
+        self.geocells.discard('event')
+        self.assertEqual(self.search(), [])
+        self.geocells.refresh([('event', make_source(self.day))])
+        self.assertEqual(self.search(), ['event'])
+
+
+class EventSearchSpecTest(SimpleTestCase):
+
+    def test_no_now(self):
+        # ES request cache skips any request using `now`
+        search = EventSearchSpec(request_cache=True).compile(Event.search())
+        body = str(search.to_dict())
+        self.assertNotIn('now', body)
+        self.assertIn(date.today().isoformat(), body)
+        self.assertEqual(search._params, {'request_cache': True})
+
+    def test_sort_unmapped_next_start(self):
+        search = EventSearchSpec().compile(Event.search())
+        self.assertEqual(search.to_dict()['sort'], [
+            {'next_start': {'order': 'asc', 'unmapped_type': 'date'}},
+            '_uid',
+        ])
+
+
+class FakeES(object):
+    """
+    Just enough of `Elasticsearch` for `bulk_index`: items are indexed
+    except `rejected` ids (429 that many times) and `broken` ones
+    (mapping error), first `busy` requests are rejected whole.
+    """
+
+    def __init__(self, rejected=None, broken=(), busy=0):
+        self.transport = mock.Mock(serializer=JSONSerializer())
+        self.indices = mock.Mock()
+        self.rejected = dict(rejected or {})
+        self.broken = set(broken)
+        self.busy = busy
+        self.bodies = []
+
+    def bulk(self, body):
+        self.bodies.append(body)
+        if self.busy:
+            self.busy -= 1
+            raise TransportError(429, 'es_rejected_execution_exception', {})
+        items = []
+        for line in body.split('\n'):
+            if '"_id"' not in line:
+                continue
+            (op_type, action), = json.loads(line).items()
+            doc_id = action['_id']
+            if self.rejected.get(doc_id):
+                self.rejected[doc_id] -= 1
+                info = {'status': 429, 'error': {
+                    'type': 'es_rejected_execution_exception'}}
+            elif doc_id in self.broken:
+                info = {'status': 400, 'error': {
+                    'type': 'mapper_parsing_exception'}}
+            else:
+                info = {'status': 200}
+            items.append({op_type: dict(info, _id=doc_id)})
+        return {'items': items}
+
+
+def bulk_actions(count):
+    return [
+        ({'update': {'_index': 'event-index', '_type': 'events',
+                     '_id': str(number)}},
+         {'doc': {'title': 'event %s' % number}, 'doc_as_upsert': True})
+        for number in range(count)
+    ]
+
+
+class BulkIndexerTest(SimpleTestCase):
+
+    def run_bulk(self, es, count, **options):
+        options.setdefault('initial_backoff', 0.001)
+        return BulkIndexer(es, **options).run(bulk_actions(count))
+
+    def test_chunk_size(self):
+        es = FakeES()
+        stats = self.run_bulk(es, 5, chunk_size=2)
+        self.assertEqual(len(es.bodies), 3)
+        self.assertEqual(
+            (stats['success'], stats['failed'], stats['retried']), (5, 0, 0)
+        )
+
+    def test_chunk_bytes(self):
+        es = FakeES()
+        item_size = len(''.join(
+            es.transport.serializer.dumps(part) + '\n'
+            for part in bulk_actions(1)[0]
+        ))
+        stats = self.run_bulk(es, 6, max_chunk_bytes=item_size * 2 + 10)
+        self.assertEqual(len(es.bodies), 3)
+        self.assertEqual(stats['success'], 6)
+
+    def test_retry_rejected_items(self):
+        es = FakeES(rejected={'1': 1, '3': 2})
+        stats = self.run_bulk(es, 4, thread_count=1)
+        # 2 items resent, then 1 again
+        self.assertEqual(
+            (stats['success'], stats['failed'], stats['retried']), (4, 0, 3)
+        )
+        self.assertEqual(len(es.bodies), 3)
+
+    def test_retry_rejected_request(self):
+        es = FakeES(busy=2)
+        stats = self.run_bulk(es, 3, thread_count=1)
+        self.assertEqual(
+            (stats['success'], stats['failed'], stats['retried']), (3, 0, 6)
+        )
+
+    def test_failures(self):
+        es = FakeES(rejected={'0': 5}, broken=['2'])
+        stats = self.run_bulk(es, 3, max_retries=2, thread_count=1)
+        # '2' fails at once, '0' is resent twice and gives up
+        self.assertEqual(
+            (stats['success'], stats['failed'], stats['retried']), (1, 2, 2)
+        )
+        self.assertEqual(stats['errors'], {
+            'es_rejected_execution_exception': 1,
+            'mapper_parsing_exception': 1,
+        })
+        self.assertEqual(
+            sorted(item['_id'] for item in stats['failures']), ['0', '2']
+        )
+
+
+class EventIndexer(ElasticsearchMixin):
+
+    @classmethod
+    def get_index_name(cls):
+        return 'event-index'
+
+    @classmethod
+    def get_type_name(cls):
+        return 'events'
+
+    @classmethod
+    def get_document(cls, obj):
+        return obj
+
+
+class LocalEventIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        day = (date.today() + timedelta(days=1)).isoformat()
+        self.schedules = [{'start_date': day, 'end_date': day}]
+        self.index = local.LocalEventIndex()
+        patcher = mock.patch.object(local, '_local_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self, **kwargs):
+        total, found = self.index.search(EventSearchSpec.from_kwargs(**kwargs))
+        return [doc_id for doc_id, _ in found]
+
+    def test_hit_ids_kept(self):
+        self.index.load([
+            ('AV1', {'title': 'Концерт', 'schedules': self.schedules})
+        ])
+        self.assertEqual(self.search(q='концерт'), ['AV1'])
+
+    def test_bulk_index_mirrored(self):
+        EventIndexer.bulk_index(es=FakeES(), queryset=[
+            {'provider': 'afi', 'provider_id': 1, 'title': 'Концерт',
+             'schedules': self.schedules},
+            {'provider': 'afi', 'provider_id': 2, 'title': 'Выставка',
+             'schedules': self.schedules},
+        ])
+        self.assertEqual(self.search(q='концерт'), ['afi_1'])
+
+        EventIndexer.write_local('', 'afi_1', {'title': 'Спектакль'},
+                                 partial=True)
+        self.assertEqual(self.search(q='концерт'), [])
+        docs = self.index.mget(['afi_1'])
+        self.assertEqual(docs[0]['_source']['provider'], 'afi')
+
+        # other indices are not mirrored
+        self.assertIsNone(local.get_local_index('place-index'))
+
+
+class SearchEventsAsyncTest(AsyncTestCase):
+    """
+    `search_events_async` answered from `hotset`: ids from the columns,
+    documents by `_mget` through the default (`_msearch` batched)
+    transport.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # `get_transport` builds `AsyncTransport` on current loop
+        asyncio.set_event_loop(self.loop)
+        self.hotset = vars(models.hotset).copy()
+        aio._transport = None
+
+    def tearDown(self):
+        vars(models.hotset).update(self.hotset)
+        aio._transport = None
+        super().tearDown()
+
+    def test_hotset_mget(self):
+        day = (date.today() + timedelta(days=1)).isoformat()
+        models.hotset.refresh([('42', {
+            'place': {'lat': 55.75, 'lng': 37.61},
+            'next_start': '%sT19:00:00' % day,
+            'schedules': [{'start_date': '%sT19:00:00' % day}],
+        })])
+        requests = []
+
+        @asyncio.coroutine
+        def perform_request(transport, method, path, **kwargs):
+            requests.append((method, path))
+            return {'docs': [{
+                '_index': 'event-index', '_type': 'events', '_id': '42',
+                'found': True, '_source': {'title': 'Concert'},
+            }]}
+
+        with mock.patch.object(
+                aio.AsyncTransport, 'perform_request', perform_request):
+            response = self.run_async(Event.search_events_async(
+                start_date=day, lat=55.75, lng=37.61, radius=5000,
+                cache=False, raw=True
+            ))
+
+        self.assertIsInstance(aio.get_transport(), aio.MultiSearchBatcher)
+        self.assertEqual(
+            requests, [('POST', '/event-index/events/_mget')]
+        )
+        self.assertEqual(response.total, 1)
+        self.assertEqual(len(response), 1)
+
+
+class ScheduleSerializer(BaseEventSerializer):
+
+    def get_schedules(self, obj):
+        return obj['schedules']
+
+
+class GetDatesTest(SimpleTestCase):
+
+    def test_parse_datetime(self):
+        for value in ['2017-11-02', '2017-11-02T19:30', '2017-11-02 19:30:15',
+                      '2017-11-02T19:30:00+03:00', '2017-11-02T19:30:00Z',
+                      '2017-11-02T19:30:00.250', '2017-11-02T19:30:00.25+0300',
+                      '02.11.2017', '02.11.2017 19:30', '31.12.2017']:
+            self.assertEqual(parse_datetime(value), parse(value), value)
+
+    def reference(self, schedules):
+        # `get_dates` before raw string filter: parse, then compare
+        dates = []
+        today = datetime.now().date()
+        for schedule in schedules:
+            start = schedule.get('start_date')
+            end = schedule.get('end_date')
+            start = parse(start) if start else None
+            end = parse(end) if end else None
+            if not (end and end.date() >= today or
+                    start and start.date() >= today):
+                continue
+            dates.append({
+                'start_date': start.date() if start else None,
+                'start_time': '%02d:%02d' % (start.hour, start.minute)
+                if start else None,
+                'end_date': end.date() if end else None,
+                'end_time': '%02d:%02d' % (end.hour, end.minute)
+                if end else None,
+            })
+        return dates
+
+    def test_get_dates(self):
+        today = date.today()
+        day = lambda days: today + timedelta(days=days)
+        schedules = [
+            {'start_date': '%sT19:00:00' % day(-10),
+             'end_date': '%sT22:00:00' % day(-10)},
+            # running since last month
+            {'start_date': '%sT10:00' % day(-30),
+             'end_date': '%sT18:00' % day(5)},
+            {'start_date': '%sT19:00:00+03:00' % today},
+            {'start_date': '%sT23:30:00.5' % day(-1),
+             'end_date': '%sT01:00:00.5' % today},
+            {'start_date': day(-2).strftime('%d.%m.%Y 19:00')},
+            {'start_date': day(3).strftime('%d.%m.%Y 19:00')},
+            {'start_date': '%s' % day(-1), 'end_date': None},
+            {'start_date': '%s' % day(7)},
+            {},
+        ]
+        dates = ScheduleSerializer().get_dates({'schedules': schedules})
+        self.assertEqual(dates, self.reference(schedules))
+        # `dd.MM.YYYY` ones depend on today: dateutil reads `05.11` as May
+        self.assertGreaterEqual(len(dates), 4)
@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import asyncio
+
+import aiohttp
+import async_timeout
+
+from .attachments import AttachmentCache
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+@aiohttp.streamer
+def stream_body(writer, content, max_size, digest):
+    # pipe downloaded image into upload request chunk by chunk
+    size = 0
+    while True:
+        chunk = yield from content.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise UploadError('image is bigger than %s bytes' % max_size)
+        digest.update(chunk)
+        yield from writer.write(chunk)
+
+
+class PhotoUploader:
+    """
+    Upload event images as VK message photos.
+
+    Image body is streamed from source url straight to VK upload server,
+    never held in memory as a whole. Both requests share one pooled
+    aiohttp session and every upload is limited by `timeout`.
+
+    Saved attachments are kept in `AttachmentCache` by url and by sha1
+    of the image body: known urls are not downloaded again, and a known
+    body under a new url reuses the saved photo instead of saving a
+    duplicate. Concurrent uploads of one url share a single request.
+    """
+
+    def __init__(self, vk, timeout=15, pool_size=20, max_size=10 * 2 ** 20,
+                 cache_size=10000, cache_ttl=30 * 24 * 60 * 60, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.vk = vk
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_size = max_size
+        self.attachments = AttachmentCache(maxsize=cache_size, ttl=cache_ttl)
+        self.pending = {}
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                loop=self.loop
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                loop=self.loop
+            )
+        return self._session
+
+    @asyncio.coroutine
+    def upload(self, url, peer_id):
+        """
+        Upload image from `url`, return `photo<owner_id>_<id>` attachment.
+        """
+        attach = self.attachments.get(url)
+        if attach:
+            return attach
+        future = self.pending.get(url)
+        if future is None:
+            future = self.pending[url] = self.loop.create_task(
+                self._upload(url, peer_id)
+            )
+            future.add_done_callback(lambda f: self.pending.pop(url, None))
+        attach = yield from asyncio.shield(future, loop=self.loop)
+        return attach
+
+    @asyncio.coroutine
+    def _upload(self, url, peer_id):
+        digest = hashlib.sha1()
+        with async_timeout.timeout(self.timeout, loop=self.loop):
+            server = yield from self.vk(
+                'photos.getMessagesUploadServer',
+                peer_id=peer_id
+            )
+            uploaded = yield from self.transfer(
+                url, server['upload_url'], digest
+            )
+            digest = digest.hexdigest()
+            attach = self.attachments.get_by_hash(digest)
+            if attach:
+                # same poster under another url, don't save a duplicate
+                self.attachments.set(url, digest, attach)
+                return attach
+            photos = yield from self.vk(
+                'photos.saveMessagesPhoto',
+                hash=uploaded['hash'],
+                photo=uploaded['photo'],
+                server=uploaded['server'],
+            )
+        if not photos:
+            raise UploadError('VK did not save photo %s' % url)
+        photo = photos[0]
+        attach = 'photo%s_%s' % (photo['owner_id'], photo['id'])
+        self.attachments.set(url, digest, attach)
+        return attach
+
+    @asyncio.coroutine
+    def transfer(self, url, upload_url, digest):
+        image = yield from self.session.get(url)
+        try:
+            if image.status != 200:
+                raise UploadError('%s answered %s' % (url, image.status))
+            form = aiohttp.FormData()
+            form.add_field(
+                'photo',
+                stream_body(image.content, self.max_size, digest),
+                filename='photo.jpg',
+                content_type=image.headers.get(
+                    aiohttp.hdrs.CONTENT_TYPE, 'image/jpeg'
+                )
+            )
+            response = yield from self.session.post(upload_url, data=form)
+            try:
+                # VK answers json with `text/html` content type
+                uploaded = yield from response.json(content_type=None)
+            finally:
+                response.release()
+        finally:
+            image.release()
+        if not uploaded or not uploaded.get('photo') or \
+                uploaded['photo'] == '[]':
+            raise UploadError('VK rejected photo %s: %s' % (url, uploaded))
+        return uploaded
+
+    @asyncio.coroutine
+    def upload_many(self, urls, peer_id):
+        """
+        Upload `urls` concurrently. Return attachment per url,
+        `None` for failed ones.
+        """
+        results = yield from asyncio.gather(
+            *[self.upload(url, peer_id) for url in urls],
+            loop=self.loop,
+            return_exceptions=True
+        )
+        attachments = []
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                logger.warning('upload %s failed: %r', url, result)
+                result = None
+            attachments.append(result)
+        return attachments
+
+    @asyncio.coroutine
+    def close(self):
+        if self._session is not None and not self._session.closed:
+            self._session.close()
+        self._session = None
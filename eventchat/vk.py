@@ -1,15 +1,13 @@
 import logging
 import rx
-import apiai
 import aiovk
-import ujson
 
-import requests
 import aiohttp
 import asyncio
 import async_timeout
 
 from geopy.geocoders import Nominatim
+from django.conf import settings
 
 from aiovk import TokenSession, API
 from aiovk.longpoll import LongPoll
@@ -17,9 +15,32 @@ from aiovk.longpoll import LongPoll
 from services.elastic.models import Event
 from social_django.models import UserSocialAuth
 
+from .dialogflow import DialogflowClient
+from .dispatcher import UserDispatcher
+from .geocache import GeocodeCache
+from .gazetteer import Gazetteer
+from .uploads import PhotoUploader
+from .batching import ExecuteBatcher, ExecuteSession
+from .ratelimit import VKScheduler, BACKGROUND
+from .preupload import PhotoPreloader
+from .sessions import ConversationStore
+
 logger = logging.getLogger(__name__)
 geolocator = Nominatim()
 
+# VK errors of `messages.send` that may be about its `attachment`:
+# access denied, invalid parameter, no access to album
+ATTACHMENT_ERRORS = (15, 100, 200)
+
+
+def blames_attachment(error):
+    """
+    VK refused the photo itself, not the user or request.
+    """
+    message = (getattr(error, 'error_msg', None) or '').lower()
+    return getattr(error, 'error_code', None) in ATTACHMENT_ERRORS and \
+        any(word in message for word in ('attach', 'photo', 'album'))
+
 
 def get_bits(n):
     b = []
@@ -56,17 +77,61 @@ class VKChat:
         self.ai_token = kwargs.get('ai_token', 0)
         self.peer_id = kwargs.get('peer_id', 0)
 
-        self.session = aiovk.TokenSession(access_token=self.vk_token)
-        self.vk = aiovk.API(self.session)
-        self.ai = apiai.ApiAI(self.ai_token)
+        # keeps per-call `execute` errors for `ExecuteBatcher`
+        self.session = ExecuteSession(access_token=self.vk_token)
+        self.api = aiovk.API(self.session)
+        # all VK calls go through throttle, replies first
+        self.vk = VKScheduler(
+            self.api,
+            loop=self.loop,
+            **getattr(settings, 'VK_RATE_LIMIT', {})
+        )
+        ai_options = dict(
+            getattr(settings, 'DIALOGFLOW_OPTIONS', {}),
+            **kwargs.get('ai_options', {})
+        )
+        self.ai = DialogflowClient(self.ai_token, loop=self.loop, **ai_options)
+        self.dispatcher = UserDispatcher(
+            self.handle_message,
+            concurrency=kwargs.get(
+                'concurrency',
+                getattr(settings, 'VKCHAT_CONCURRENCY', 10)
+            ),
+            loop=self.loop
+        )
+        self.geocoder = GeocodeCache(
+            geolocator,
+            loop=self.loop,
+            **getattr(settings, 'GEOCODE_CACHE', {})
+        )
+        self.batcher = ExecuteBatcher(
+            self.vk,
+            loop=self.loop,
+            **getattr(settings, 'VK_EXECUTE_BATCHER', {})
+        )
+        self.uploader = PhotoUploader(
+            self.vk,
+            loop=self.loop,
+            **getattr(settings, 'PHOTO_UPLOADER', {})
+        )
+        # shares `self.vk` limit, behind replies and chat uploads
+        self.preloader = PhotoPreloader(
+            self.vk,
+            self.peer_id,
+            priority=BACKGROUND,
+            loop=self.loop,
+            **getattr(settings, 'PHOTO_PRELOADER', {})
+        )
+        self.conversations = ConversationStore(
+            **getattr(settings, 'VKCHAT_CONVERSATIONS', {})
+        )
+        self.gazetteer = Gazetteer.from_vk_cities(
+            getattr(settings, 'GAZETTEER', {}).get('coords_path')
+        )
 
     @asyncio.coroutine
     def get_answer(self, user_id, message):
-        request = self.ai.text_request()
-        request.query = message
-        request.session_id = user_id
-        response = request.getresponse()
-        data = ujson.loads(response.read())
+        data = yield from self.ai.query(user_id, message)
         return data
 
     @asyncio.coroutine
@@ -76,95 +141,163 @@ class VKChat:
         params = result['parameters']
         message = result['fulfillment']['speech']
 
-        size = 5 if 'where-is-party-next' in action else 1
-        offset = 1 if 'where-is-party-next' in action else 0
-        if 'where-is-party-next' in action:
+        next_page = 'where-is-party-next' in action
+        size = 4 if next_page else 1
+        offset = cursor = None
+        state = self.conversations.get(user_id) if next_page else None
+        if state:
+            # continue after last shown event
+            params = state['params']
+            cursor = state['cursor']
+        elif next_page:
+            # no saved state (bot restarted), skip first event again
+            offset = 1
             contexts = result['contexts']
             if len(contexts):
                 params = contexts[0]['parameters']
 
         print('params %s' % params)
-        # send `welcome` message
-        if message:
-            message = yield from self.send_message(user_id, message)
-        events = yield from self.search_events(**params)
-
-        if events and events.hits.total:
-            for event in events[offset:size]:
-                attach_photo = getattr(event, 'attach', '')
-                place = event.place
-                if event.image and not attach_photo:
-                    # TODO upload photo to vk server
-                    image = requests.get(event.image, stream=True)
-                    files = {'photo': ('photo.jpg', image.content)}
-                    server = yield from self.vk(
-                        'photos.getMessagesUploadServer',
-                        peer_id=user_id
-                    )
-                    image_response = requests.post(
-                        server['upload_url'],
-                        files=files
-                    )
-                    try:
-                        image_response_json = image_response.json()
-                        response = yield from self.vk(
-                            'photos.saveMessagesPhoto',
-                            hash=image_response_json['hash'],
-                            photo=image_response_json['photo'],
-                            server=image_response_json['server'],
-                        )
-                        print(response)
-                    except:
-                        response = None
-                    ###
-                    images = response
-                    if images:
-                        image = images[0]
-                        attach_photo = 'photo%s_%s' % (
-                            image['owner_id'],
-                            image['id']
-                        )
-                        event.attach = attach_photo
-                        event.save()
-
-                kwargs = {
-                    'attachment': attach_photo
-                }
-                if place.lat and place.lng:
-                    kwargs['lat'] = str(place.lat)
-                    kwargs['long'] = str(place.lng)
-
-                # TODO serialize dates/places message answer
-                dates = event.dates[0] if event.dates else {}
-                start = end = ''
-                if 'start_date' in dates:
-                    start = dates.start_date.strftime('%d.%m.%Y %H:%M')
-                    start = 'Начало - %s' % start
-                if 'end_date' in dates:
-                    end = dates.end_date.strftime('%d.%m.%Y %H:%M')
-                    end = 'Окончание - %s' % end
-                place = 'Место - %s' % event.place.title
-                text = '%s \n %s \n %s \n %s \n %s' % (
-                    event.title, place,
-                    start, end,
-                    (event.description or '')[:100]
-                )
-                try:
-                    yield from self.send_message(
+        try:
+            events = yield from self.search_events(
+                offset=offset or 0,
+                size=size,
+                search_after=cursor,
+                **params
+            )
+
+            cards = []
+            if events and events.total:
+                events = list(events)
+                if events:
+                    self.conversations.set(
                         user_id,
-                        text,
-                        **kwargs
+                        params=params,
+                        cursor=events[-1].sort
                     )
-                except:
-                    print('error %s' % kwargs)
+                attachments = yield from self.upload_photos(user_id, events)
+                cards = zip(events, attachments)
+        except Exception:
+            # user still gets `welcome` message, alone
+            if message:
+                try:
+                    yield from self.send_message(user_id, message)
+                except Exception:
+                    logger.exception('welcome to %s failed', user_id)
+            raise
+
+        # `welcome` message and event cards are queued at once and in
+        # order (as tasks, `gather` starts coroutines in any order),
+        # batcher sends them in one `execute` request
+        sends = []
+        if message:
+            sends.append(self.send_message(user_id, message))
+        sends.extend(
+            self.send_card(user_id, event, attach_photo)
+            for event, attach_photo in cards
+        )
+        yield from asyncio.gather(*[
+            self.loop.create_task(send) for send in sends
+        ], loop=self.loop)
         return events
 
     @asyncio.coroutine
-    def search_events(self, **kwargs):
+    def send_card(self, user_id, event, attach_photo):
+        kwargs = {
+            'attachment': attach_photo
+        }
+        if event.lat and event.lng:
+            kwargs['lat'] = str(event.lat)
+            kwargs['long'] = str(event.lng)
+
+        # card text is precomputed at index time, see `BaseEventSerializer`
+        text = event.text
+        try:
+            yield from self.send_message(
+                user_id,
+                text,
+                **kwargs
+            )
+        except Exception as e:
+            logger.warning('card %s to %s failed: %r', event.id, user_id, e)
+            if not attach_photo or not blames_attachment(e):
+                # timeouts, limits, user privacy: the photo is fine
+                return
+            # VK may drop saved photos, forget it and
+            # send text-only card
+            yield from self.forget_photo(event, attach_photo)
+            kwargs.pop('attachment')
+            try:
+                yield from self.send_message(
+                    user_id,
+                    text,
+                    **kwargs
+                )
+            except Exception as e:
+                logger.warning('text card %s to %s failed: %r',
+                               event.id, user_id, e)
+
+    @asyncio.coroutine
+    def upload_photos(self, user_id, events):
+        """
+        Return attachment per event. Missing photos are uploaded
+        concurrently, failed uploads give text-only cards.
+        """
+        attachments = [
+            event.attach if self.uploader.attachments.is_valid(event.attach)
+            else '' for event in events
+        ]
+        missing = [
+            index for index, event in enumerate(events)
+            if event.image and not attachments[index]
+        ]
+        uploaded = yield from self.uploader.upload_many(
+            [events[index].image for index in missing],
+            user_id
+        )
+        for index, attach_photo in zip(missing, uploaded):
+            if attach_photo:
+                attachments[index] = attach_photo
+                self.save_attach(events[index], attach_photo)
+        return attachments
+
+    @asyncio.coroutine
+    def forget_photo(self, event, attach_photo):
+        self.uploader.attachments.invalidate(attach_photo)
+        if event.attach == attach_photo:
+            # null, not '': `exists` keeps matching empty strings
+            self.save_attach(event, None)
+
+    def save_attach(self, event, attach_photo):
+        event.attach = attach_photo
+        # blocking ES update in background, card doesn't wait for it
+        self.loop.create_task(self._save_attach(event.id, attach_photo))
+
+    @asyncio.coroutine
+    def _save_attach(self, event_id, attach_photo):
+        try:
+            # partial update by id, `event` is a raw `EventCard`
+            yield from self.loop.run_in_executor(
+                None,
+                lambda: Event(meta={'id': event_id}).update(
+                    attach=attach_photo
+                )
+            )
+        except Exception:
+            logger.exception('failed to save attach of event %s', event_id)
+
+    @asyncio.coroutine
+    def geocode(self, city):
+        # offline gazetteer first, Nominatim only for unknown names
+        coords = self.gazetteer.lookup(city) if city else None
+        if coords is None:
+            coords = yield from self.geocoder.geocode(city)
+        return coords
+
+    @asyncio.coroutine
+    def search_events(self, offset=0, size=1, search_after=None, **kwargs):
         if any(kwargs.values()):
-            geocode = geolocator.geocode(kwargs.get('geo-city', ''))
-            lat = geocode.raw.get('lat', None) if geocode else None
-            lng = geocode.raw.get('lon', None) if geocode else None
+            coords = yield from self.geocode(kwargs.get('geo-city', ''))
+            lat, lng = coords or (None, None)
             date = kwargs.get('date', [])
             query = kwargs.get('genre', '')
             category = kwargs.get('category', '')
@@ -178,8 +311,14 @@ class VKChat:
                 params['lat'] = lat  # profile.get('lat', None),
                 params['lng'] = lng  # profile.get('lng', None),
                 params['radius'] = 1000  # profile.get('radius', 80000),
+            params['projection'] = 'chat_card'
+            params['raw'] = True
+            params['limit_from'] = offset
+            params['limit_to'] = offset + size
+            if search_after:
+                params['search_after'] = search_after
 
-            events = Event.search_events(**params)
+            events = yield from Event.search_events_async(**params)
             return events
 
     @asyncio.coroutine
@@ -200,7 +339,7 @@ class VKChat:
 
     @asyncio.coroutine
     def send_message(self, user_id, message, **kwargs):
-        return self.vk(
+        result = yield from self.batcher.call(
             'messages.send',
             user_id=user_id,
             message=message,
@@ -208,21 +347,52 @@ class VKChat:
             peer_id=self.peer_id,
             **kwargs
         )
+        return result
+
+    @asyncio.coroutine
+    def handle_message(self, user_id, message):
+        answer = yield from self.get_answer(user_id, message)
+        print('answer: %s' % answer)
+        events = yield from self.send_answer(user_id, answer)
+        return events
 
     @asyncio.coroutine
     def wait_user_input(self):
         # listen long poll user chat session
-        longpoll = LongPoll(self.vk, mode=2)
+        longpoll = LongPoll(self.api, mode=2)
+        self.dispatcher.start()
+        self.loop.create_task(self.refresh_geocells())
+        interval = getattr(settings, 'PHOTO_PRELOADER_INTERVAL', None)
+        if interval:
+            self.loop.create_task(self.preloader.run_forever(interval))
         while True:
             result = yield from longpoll.wait()
             for update in result.get('updates', []):
                 user_id, message = yield from self.parse_message_updates(*update)
                 if user_id and message:
-                    answer = yield from self.get_answer(user_id, message)
-                    print('answer: %s' % answer)
-                    events = yield from self.send_answer(user_id, answer)
+                    # answer in background, keep polling for other users
+                    self.dispatcher.put(user_id, message)
             print('result: %s' % result)
 
+    @asyncio.coroutine
+    def refresh_geocells(self):
+        interval = getattr(settings, 'EVENT_GEOCELLS_REFRESH_INTERVAL', 300)
+        while True:
+            try:
+                # scan is blocking, keep it off the event loop
+                yield from self.loop.run_in_executor(
+                    None, Event.refresh_geocells
+                )
+            except Exception:
+                logger.exception('geocells refresh failed')
+            try:
+                yield from self.loop.run_in_executor(
+                    None, Event.refresh_hotset
+                )
+            except Exception:
+                logger.exception('hotset refresh failed')
+            yield from asyncio.sleep(interval, loop=self.loop)
+
     @asyncio.coroutine
     def get_user_token(self, user_id, **kwargs):
         social = UserSocialAuth.objects.filter(uid=user_id)
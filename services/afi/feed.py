@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from lxml import etree
+
+from services.afi.schema import PlaceSerializer, EventSerializer
+from services.pipeline import ParallelSerializer, serialize
+
+logger = logging.getLogger(__name__)
+
+
+def local_name(tag):
+    return etree.QName(tag).localname
+
+
+def element_to_dict(element):
+    """
+    xmltodict-shaped value of `element`: attributes as `@name`, text as
+    `#text` next to attributes or children, repeated children as list,
+    plain text for simple elements, `None` for empty ones.
+    """
+    result = {}
+    for name, value in element.attrib.items():
+        result['@%s' % local_name(name)] = value
+    for child in element:
+        if not isinstance(child.tag, str):
+            # comments and processing instructions
+            continue
+        name = local_name(child.tag)
+        value = element_to_dict(child)
+        if name in result:
+            if not isinstance(result[name], list):
+                result[name] = [result[name]]
+            result[name].append(value)
+        else:
+            result[name] = value
+
+    text = (element.text or '').strip()
+    if not result:
+        return text or None
+    if text:
+        result['#text'] = text
+    return result
+
+
+def iter_items(source, tag, skip=()):
+    """
+    Stream `tag` elements of XML `source` (path or file) as dicts.
+    Every element is cleared after conversion with its processed
+    siblings, so memory doesn't grow with feed size.
+
+    `skip` tags are cleared the same way without conversion: `tag`
+    filter of `iterparse` passes by other elements, not frees them,
+    so bulky sections of other items must be listed there.
+    """
+    context = etree.iterparse(
+        source, events=('end',), huge_tree=True,
+        tag=['{*}%s' % name for name in (tag, ) + tuple(skip)]
+    )
+    for _, element in context:
+        if not skip or local_name(element.tag) == tag:
+            yield element_to_dict(element)
+        elif next(element.iterancestors('{*}%s' % tag), None) is not None:
+            # part of `tag` element, converted and cleared with it
+            continue
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+    del context
+
+
+class AfiFeed(object):
+    """
+    Streaming AFI XML import: `company` elements go to `place-index`,
+    `creation` elements with their company as `place` to `event-index`,
+    both through provider serializers and streaming `bulk_index` by
+    `chunk_size` documents.
+
+    The feed is read twice with `iterparse`: companies first, kept as
+    dicts by `place_key` to join events, then creations, so only
+    companies and one chunk of events are in memory at once; each
+    pass clears elements of the other one unconverted.
+    With `workers` items are serialized by `ParallelSerializer` on
+    that many processes.
+    """
+
+    def __init__(self, source, chunk_size=500, event_tag='creation',
+                 place_tag='company', place_key='company-id', workers=None):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.event_tag = event_tag
+        self.place_tag = place_tag
+        self.place_key = place_key
+        self.places = {}
+
+    def iter_places(self):
+        for item in iter_items(self.source, self.place_tag,
+                               skip=(self.event_tag, )):
+            if isinstance(item, dict) and item.get(self.place_key):
+                self.places[item[self.place_key]] = item
+                yield item
+
+    def iter_events(self):
+        for item in iter_items(self.source, self.event_tag,
+                               skip=(self.place_tag, )):
+            if not isinstance(item, dict):
+                continue
+            item['place'] = self.places.get(item.get(self.place_key))
+            yield item
+
+    def index(self, serializer_class, items):
+        if self.workers:
+            docs = ParallelSerializer(
+                serializer_class, workers=self.workers
+            )(items)
+        else:
+            docs = serialize(items, serializer_class)
+        stats = serializer_class.bulk_index(
+            queryset=docs, chunk_size=self.chunk_size
+        )
+        logger.debug('%s: %s', serializer_class.__name__, stats)
+        return stats['success']
+
+    def run(self):
+        """
+        Import the feed, return `(places, events)` indexed counts.
+        """
+        places = self.index(PlaceSerializer, self.iter_places())
+        events = self.index(EventSerializer, self.iter_events())
+        return places, events
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import itertools
+
+import aiohttp
+import async_timeout
+import ujson
+
+from django.conf import settings
+from elasticsearch.exceptions import (
+    HTTP_EXCEPTIONS, TransportError, ConnectionError, ConnectionTimeout
+)
+
+
+class AsyncTransport(object):
+    """
+    Awaitable ES transport on a pooled aiohttp session.
+    Knows only what the chat bot needs: `search` and raw `perform_request`.
+    """
+
+    def __init__(self, hosts=None, timeout=10, pool_size=100, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        params = settings.ELASTICSEARCH_CONNECTION_PARAMS
+        hosts = hosts or params.get('hosts', 'localhost:9200')
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        self.hosts = itertools.cycle([
+            host if host.startswith('http') else 'http://%s' % host
+            for host in hosts
+        ])
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                loop=self.loop
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                loop=self.loop
+            )
+        return self._session
+
+    @asyncio.coroutine
+    def perform_request(self, method, path, params=None, body=None,
+                        data=None, content_type='application/json'):
+        url = '%s%s' % (next(self.hosts), path)
+        if params:
+            params = {
+                key: str(value).lower() if isinstance(value, bool) else value
+                for key, value in params.items()
+            }
+        if body is not None:
+            data = ujson.dumps(body)
+        try:
+            with async_timeout.timeout(self.timeout, loop=self.loop):
+                response = yield from self.session.request(
+                    method, url,
+                    params=params,
+                    data=data,
+                    headers={'Content-Type': content_type}
+                )
+                try:
+                    text = yield from response.text()
+                finally:
+                    response.release()
+        except asyncio.TimeoutError as e:
+            raise ConnectionTimeout('TIMEOUT', str(e), e)
+        except aiohttp.ClientError as e:
+            raise ConnectionError('N/A', str(e), e)
+
+        if response.status >= 400:
+            try:
+                info = ujson.loads(text)
+                error = info.get('error', text)
+                if isinstance(error, dict):
+                    error = error.get('type', error)
+            except ValueError:
+                info, error = text, text
+            raise HTTP_EXCEPTIONS.get(response.status, TransportError)(
+                response.status, error, info
+            )
+        return ujson.loads(text)
+
+    @asyncio.coroutine
+    def search(self, index, doc_type, body, params=None):
+        path = '/%s/%s/_search' % (index, doc_type)
+        result = yield from self.perform_request(
+            'POST', path, params=params, body=body
+        )
+        return result
+
+    @asyncio.coroutine
+    def msearch(self, searches):
+        """
+        Send `(index, doc_type, body, params)` searches in one `_msearch`,
+        return list of per-search responses (or `{'error': ...}`).
+        """
+        lines = []
+        for index, doc_type, body, params in searches:
+            header = {'index': index, 'type': doc_type}
+            if params and params.get('request_cache'):
+                header['request_cache'] = True
+            lines.append(ujson.dumps(header))
+            lines.append(ujson.dumps(body))
+        result = yield from self.perform_request(
+            'POST', '/_msearch',
+            data='\n'.join(lines) + '\n',
+            content_type='application/x-ndjson'
+        )
+        return result['responses']
+
+    @asyncio.coroutine
+    def close(self):
+        if self._session is not None and not self._session.closed:
+            self._session.close()
+        self._session = None
+
+
+class MultiSearchBatcher(object):
+    """
+    Collect `search` calls arriving within `max_wait` seconds and send
+    them as one `_msearch` request of up to `max_batch` searches, then
+    hand every response back to its waiting coroutine.
+
+    Has the same `search` and `perform_request` signatures as
+    `AsyncTransport`, so it can be passed as `transport` to
+    `Event.search_events_async`; raw requests (`_mget`) go to the
+    wrapped transport unbatched. Per-search `filter_path` is dropped,
+    `_msearch` applies it to the whole batch.
+    """
+
+    def __init__(self, transport, max_batch=20, max_wait=0.005, loop=None):
+        self.loop = loop or transport.loop
+        self.transport = transport
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = []
+        self._handle = None
+
+    @asyncio.coroutine
+    def perform_request(self, *args, **kwargs):
+        result = yield from self.transport.perform_request(*args, **kwargs)
+        return result
+
+    @asyncio.coroutine
+    def search(self, index, doc_type, body, params=None):
+        future = self.loop.create_future()
+        self.queue.append(((index, doc_type, body, params), future))
+        if len(self.queue) >= self.max_batch:
+            self.flush()
+        elif self._handle is None:
+            self._handle = self.loop.call_later(self.max_wait, self.flush)
+        result = yield from future
+        return result
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        while self.queue:
+            batch = self.queue[:self.max_batch]
+            self.queue = self.queue[self.max_batch:]
+            self.loop.create_task(self._send(batch))
+
+    @asyncio.coroutine
+    def _send(self, batch):
+        try:
+            if len(batch) == 1:
+                (index, doc_type, body, params), _ = batch[0]
+                response = yield from self.transport.search(
+                    index, doc_type, body, params=params
+                )
+                responses = [response]
+            else:
+                responses = yield from self.transport.msearch(
+                    [search for search, _ in batch]
+                )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), response in zip(batch, responses):
+            if future.done():
+                continue
+            if 'error' in response:
+                error = response['error']
+                if isinstance(error, dict):
+                    error = error.get('type', error)
+                future.set_exception(TransportError(
+                    response.get('status', 'N/A'), error, response
+                ))
+            else:
+                future.set_result(response)
+
+    @asyncio.coroutine
+    def close(self):
+        self.flush()
+        yield from self.transport.close()
+
+
+_transport = None
+
+
+def get_transport():
+    """
+    Shared transport of the process, batched with `_msearch` when
+    `ELASTICSEARCH_MSEARCH` is set.
+    """
+    global _transport
+    if _transport is None:
+        _transport = AsyncTransport(
+            **getattr(settings, 'ELASTICSEARCH_ASYNC_PARAMS', {})
+        )
+        msearch = getattr(settings, 'ELASTICSEARCH_MSEARCH', None)
+        if msearch is not None:
+            _transport = MultiSearchBatcher(_transport, **msearch)
+    return _transport
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from elasticsearch import TransportError
+
+logger = logging.getLogger(__name__)
+
+# rejected by full bulk queue, worth retrying
+RETRY_STATUS = 429
+
+
+class BulkIndexer(object):
+    """
+    Streaming `_bulk` engine: reads `(action, doc)` pairs from any
+    iterable, cuts them into requests of at most `chunk_size` actions
+    and `max_chunk_bytes` bytes, keeps up to `thread_count` requests in
+    flight, resends items rejected with 429 (or whole 429 requests)
+    after exponential backoff and returns per-item stats:
+
+        {'success': 10, 'failed': 1, 'retried': 2,
+         'errors': {'mapper_parsing_exception': 1},
+         'failures': [first `max_failures` failed items]}
+    """
+
+    def __init__(self, es, chunk_size=500, max_chunk_bytes=10 * 1024 * 1024,
+                 thread_count=4, max_retries=3, initial_backoff=1,
+                 max_backoff=60, max_failures=100):
+        self.es = es
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.thread_count = thread_count
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_failures = max_failures
+        self.serializer = es.transport.serializer
+
+    def chunks(self, actions):
+        """
+        Serialized `[(lines, action)]` chunks limited by count and bytes.
+        """
+        chunk, size = [], 0
+        for action, doc in actions:
+            lines = [self.serializer.dumps(action)]
+            if doc is not None:
+                lines.append(self.serializer.dumps(doc))
+            item_size = sum(len(line.encode('utf-8')) + 1 for line in lines)
+            if chunk and (len(chunk) >= self.chunk_size or
+                          size + item_size > self.max_chunk_bytes):
+                yield chunk
+                chunk, size = [], 0
+            chunk.append((lines, action))
+            size += item_size
+        if chunk:
+            yield chunk
+
+    def send(self, chunk):
+        """
+        Send one chunk, retrying rejected items.
+        Return `(success, retried, [failed item])`.
+        """
+        success = retried = 0
+        # items failed for good, across attempts
+        failed = []
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                retried += len(chunk)
+                time.sleep(min(
+                    self.max_backoff,
+                    self.initial_backoff * 2 ** (attempt - 1)
+                ))
+            body = '\n'.join(
+                line for lines, _ in chunk for line in lines
+            ) + '\n'
+            try:
+                result = self.es.bulk(body=body)
+            except TransportError as e:
+                if e.status_code == RETRY_STATUS and attempt < self.max_retries:
+                    continue
+                return success, retried, failed + [
+                    {'status': e.status_code, 'error': e.error, 'action': action}
+                    for _, action in chunk
+                ]
+
+            rejected = []
+            for item, (lines, action) in zip(result['items'], chunk):
+                op_type, info = item.popitem()
+                if 'error' not in info:
+                    success += 1
+                elif info.get('status') == RETRY_STATUS and \
+                        attempt < self.max_retries:
+                    rejected.append((lines, action))
+                else:
+                    failed.append(dict(info, op_type=op_type))
+            if not rejected:
+                return success, retried, failed
+            chunk = rejected
+        return success, retried, failed
+
+    def run(self, actions):
+        stats = {
+            'success': 0, 'failed': 0, 'retried': 0,
+            'errors': Counter(), 'failures': [],
+        }
+
+        def collect(future):
+            success, retried, failed = future.result()
+            stats['success'] += success
+            stats['retried'] += retried
+            stats['failed'] += len(failed)
+            for info in failed:
+                error = info.get('error')
+                if isinstance(error, dict):
+                    error = error.get('type', error)
+                stats['errors'][str(error)] += 1
+                if len(stats['failures']) < self.max_failures:
+                    stats['failures'].append(info)
+
+        # bounded chunks in memory: `thread_count` sent, as many queued
+        in_flight = deque()
+        with ThreadPoolExecutor(self.thread_count) as executor:
+            for chunk in self.chunks(actions):
+                if len(in_flight) >= self.thread_count * 2:
+                    collect(in_flight.popleft())
+                in_flight.append(executor.submit(self.send, chunk))
+            while in_flight:
+                collect(in_flight.popleft())
+
+        stats['errors'] = dict(stats['errors'])
+        if stats['failed']:
+            logger.warning('bulk: %s of %s items failed: %s',
+                           stats['failed'],
+                           stats['failed'] + stats['success'],
+                           stats['errors'])
+        return stats
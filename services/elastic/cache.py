@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from datetime import date
+from collections import OrderedDict
+from dateutil.parser import parse
+
+# search kwargs which don't change results
+SKIP_KEYS = ('observable', 'cache')
+COORDS_PRECISION = 3
+
+_caches = {}
+
+
+def normalize_date(value):
+    if not value:
+        return None
+    try:
+        return parse(str(value)).date().isoformat()
+    except (ValueError, OverflowError):
+        return str(value)
+
+
+def normalize_query(value):
+    return ' '.join(str(value or '').lower().split())
+
+
+def normalize_coord(value):
+    try:
+        return round(float(value), COORDS_PRECISION)
+    except (TypeError, ValueError):
+        return None
+
+
+class SearchCache(object):
+    """
+    LRU cache with TTL for `search_events` responses, keyed by normalized
+    kwargs: dates rounded to days, coordinates to ~100m, `q` lowercased
+    with collapsed spaces. Today's date is part of the key, so
+    queries with today based date filters roll over at midnight.
+
+    Caches are registered per index and dropped by `invalidate(index)`
+    on every write to it. Invalidation is in-process only, `ttl` bounds
+    staleness for writes made by other processes.
+    """
+
+    def __init__(self, index, maxsize=1000, ttl=300):
+        self.index = index
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = self.misses = 0
+        _caches.setdefault(index, []).append(self)
+
+    def key(self, kwargs):
+        params = []
+        for name, value in sorted(kwargs.items()):
+            if name in SKIP_KEYS:
+                continue
+            if name in ('start_date', 'end_date'):
+                value = normalize_date(value)
+            elif name in ('lat', 'lng'):
+                value = normalize_coord(value)
+            elif name == 'q':
+                value = normalize_query(value)
+            elif isinstance(value, list):
+                value = tuple(value)
+            elif isinstance(value, dict):
+                value = tuple(sorted(value.items()))
+            params.append((name, value))
+        return (date.today().isoformat(), ) + tuple(params)
+
+    def get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires, value = item
+        if expires < time.time():
+            del self.data[key]
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.data[key] = (time.time() + self.ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+
+def invalidate(index):
+    for cache in _caches.get(index, []):
+        cache.clear()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import logging
+import calendar
+
+from bisect import bisect_left
+from datetime import date, datetime
+from dateutil.parser import parse
+
+logger = logging.getLogger(__name__)
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS = 6371000.0
+# ES sort value of missing `next_start`
+MISSING = 2 ** 63 - 1
+
+
+def geohash(lat, lng, precision=5):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    result, bits, bit, even = [], 0, 0, True
+    while len(result) < precision:
+        if even:
+            middle = (lng_range[0] + lng_range[1]) / 2
+            if lng > middle:
+                bits = bits << 1 | 1
+                lng_range[0] = middle
+            else:
+                bits <<= 1
+                lng_range[1] = middle
+        else:
+            middle = (lat_range[0] + lat_range[1]) / 2
+            if lat > middle:
+                bits = bits << 1 | 1
+                lat_range[0] = middle
+            else:
+                bits <<= 1
+                lat_range[1] = middle
+        even = not even
+        bit += 1
+        if bit == 5:
+            result.append(BASE32[bits])
+            bits = bit = 0
+    return ''.join(result)
+
+
+def cell_size(precision):
+    """
+    (lat, lng) size of geohash cell in degrees.
+    """
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def distance(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def cover(lat, lng, radius, precision=5):
+    """
+    Geohash cells covering circle of `radius` meters around point.
+    """
+    dlat = math.degrees(radius / EARTH_RADIUS)
+    dlng = dlat / max(math.cos(math.radians(lat)), 0.01)
+    step_lat, step_lng = cell_size(precision)
+    cells = set()
+    y = lat - dlat
+    while True:
+        x = lng - dlng
+        while True:
+            cells.add(geohash(y, x, precision))
+            if x >= lng + dlng:
+                break
+            x = min(x + step_lng, lng + dlng)
+        if y >= lat + dlat:
+            break
+        y = min(y + step_lat, lat + dlat)
+    return cells
+
+
+def get_sort(doc_type, doc_id, next_start):
+    """
+    ES sort values of `search_events`: (`next_start` ms, `_uid`).
+    """
+    return [
+        calendar.timegm(next_start.timetuple()) * 1000
+        if next_start else MISSING,
+        '%s#%s' % (doc_type, doc_id),
+    ]
+
+
+def to_day(value):
+    if not value:
+        return None
+    if not isinstance(value, (date, datetime)):
+        value = parse(str(value))
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal()
+
+
+class GeoCellIndex(object):
+    """
+    Upcoming events grouped by geohash cell: id, coordinates,
+    `next_start`, schedule start days, last end day and category slug.
+
+    Answers `EventSearchSpec` with radius and dates but without `q`
+    (see `can_answer`) with ids and sort values in `search_events`
+    order (`next_start`, `_uid`); documents are fetched by id after.
+    `refresh` rebuilds the whole index from `event-index` and swaps it
+    at once, the index is not used when older than `max_age` seconds.
+    `discard` hides deleted events until next `refresh`.
+    """
+
+    def __init__(self, precision=5, max_age=15 * 60, doc_type='events'):
+        self.precision = precision
+        self.max_age = max_age
+        self.doc_type = doc_type
+        self.cells = {}
+        self.discarded = set()
+        self.updated = 0
+
+    @property
+    def fresh(self):
+        return bool(self.cells) and \
+            time.time() - self.updated < self.max_age
+
+    def can_answer(self, spec):
+        return self.fresh and not spec.q and spec.has_geo
+
+    @staticmethod
+    def source_fields():
+        return [
+            'place.lat', 'place.lng', 'next_start', 'category.slug',
+            'schedules.start_date', 'schedules.end_date',
+        ]
+
+    def refresh(self, hits):
+        """
+        Rebuild from `(id, _source)` pairs of upcoming events.
+        """
+        cells = {}
+        count = 0
+        for doc_id, source in hits:
+            place = source.get('place') or {}
+            lat, lng = place.get('lat'), place.get('lng')
+            if not lat or not lng:
+                continue
+            schedules = source.get('schedules') or []
+            if isinstance(schedules, dict):
+                schedules = [schedules]
+            try:
+                starts = sorted(set(
+                    to_day(item.get('start_date')) for item in schedules
+                    if item.get('start_date')
+                ))
+                ends = [
+                    to_day(item.get('end_date')) for item in schedules
+                    if item.get('end_date')
+                ]
+                next_start = source.get('next_start')
+                next_start = parse(next_start) if next_start else None
+            except (ValueError, OverflowError):
+                continue
+            sort = get_sort(self.doc_type, doc_id, next_start)
+            cell = geohash(float(lat), float(lng), self.precision)
+            category = source.get('category') or {}
+            cells.setdefault(cell, []).append((
+                doc_id, float(lat), float(lng), sort,
+                starts, max(ends) if ends else None, category.get('slug'),
+            ))
+            count += 1
+        self.cells = cells
+        self.discarded = set()
+        self.updated = time.time()
+        logger.debug('geocells: %s events in %s cells', count, len(cells))
+
+    def discard(self, doc_id):
+        self.discarded.add(doc_id)
+
+    def match_dates(self, spec, starts, last_end, day_from, day_to, today):
+        # same filters as `EventSearchSpec.get_filters`
+        if not spec.start_date and (last_end is None or last_end < today):
+            return False
+        if day_from is None:
+            return True
+        index = bisect_left(starts, day_from)
+        return index < len(starts) and starts[index] <= day_to
+
+    def search(self, spec):
+        """
+        Return `(total, [(id, sort)])` page for `spec`,
+        `None` if spec dates can't be parsed.
+        """
+        today = date.today().toordinal()
+        try:
+            day_from = to_day(spec.start_date or spec.end_date)
+            day_to = to_day(spec.end_date or spec.start_date)
+        except (ValueError, OverflowError):
+            return None
+        lat, lng, radius = float(spec.lat), float(spec.lng), float(spec.radius)
+        discarded = self.discarded
+
+        found = []
+        for cell in cover(lat, lng, radius, self.precision):
+            for doc_id, doc_lat, doc_lng, sort, starts, last_end, category \
+                    in self.cells.get(cell, ()):
+                if spec.category_slug and category != spec.category_slug:
+                    continue
+                if doc_id in discarded:
+                    continue
+                if not self.match_dates(spec, starts, last_end,
+                                        day_from, day_to, today):
+                    continue
+                if distance(lat, lng, doc_lat, doc_lng) > radius:
+                    continue
+                found.append((doc_id, sort))
+
+        found.sort(key=lambda item: item[1])
+        total = len(found)
+        if spec.search_after:
+            after = list(spec.search_after)
+            found = [item for item in found if item[1] > after]
+            return total, found[:spec.limit_to - spec.limit_from]
+        return total, found[spec.limit_from:spec.limit_to]
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+import calendar
+
+from datetime import date, timedelta
+from dateutil.parser import parse
+
+import numpy as np
+
+from .geocells import EARTH_RADIUS, MISSING, to_day
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    ('lat', np.float64),
+    ('lng', np.float64),
+    ('start', np.int32),
+    ('next_start', np.int64),
+    ('category', np.int32),
+    ('deleted', np.bool_),
+    ('event', np.int32),
+)
+
+
+class HotSet(object):
+    """
+    Columnar replica of events starting within next `days` days.
+
+    One row per (event, schedule start day) in NumPy arrays: `lat`,
+    `lng`, `start` day ordinal, `next_start` ms, `category` id (index
+    in `categories` vocabulary), `deleted` flag and `event` row (index
+    in `ids`). `search` filters all rows with one vectorized mask.
+
+    Answers `EventSearchSpec` without `q` whose start dates lie inside
+    the window (see `can_answer`); open date queries match events
+    running for a year and stay with ES or `geocells`.
+    Events without place coordinates keep `NaN` `lat`/`lng`, radius
+    filter never matches them.
+
+    `refresh` rebuilds the arrays, `update` upserts changed documents
+    and `discard` flips `deleted` flag in place.
+    """
+
+    def __init__(self, days=7, max_age=15 * 60, rebuild_interval=60 * 60,
+                 doc_type='events'):
+        self.days = days
+        self.max_age = max_age
+        self.rebuild_interval = rebuild_interval
+        self.doc_type = doc_type
+        self.docs = {}
+        self.updated = 0
+        self.rebuilt = 0
+        self.since = None
+        self.today = None
+        self._build()
+
+    @property
+    def fresh(self):
+        return self.today == date.today().toordinal() and \
+            time.time() - self.updated < self.max_age
+
+    @property
+    def needs_rebuild(self):
+        return self.since is None or \
+            self.today != date.today().toordinal() or \
+            time.time() - self.rebuilt > self.rebuild_interval
+
+    def window(self):
+        today = date.today()
+        return today, today + timedelta(days=self.days)
+
+    def can_answer(self, spec):
+        if not self.fresh or spec.q or not spec.start_date:
+            return False
+        try:
+            day_from = to_day(spec.start_date)
+            day_to = to_day(spec.end_date or spec.start_date)
+        except (ValueError, OverflowError):
+            return False
+        return self.today <= day_from and day_to <= self.today + self.days
+
+    @staticmethod
+    def source_fields():
+        return [
+            'place.lat', 'place.lng', 'next_start', 'deleted',
+            'category.slug', 'schedules.start_date',
+        ]
+
+    def parse(self, source, day_from, day_to):
+        """
+        `(lat, lng, next_start, category, deleted, starts)` row of
+        `_source`, `None` for events without starts in window.
+        """
+        place = source.get('place') or {}
+        lat, lng = place.get('lat'), place.get('lng')
+        if not lat or not lng:
+            # `np.nan` itself, so unchanged rows compare equal in `update`
+            lat = lng = np.nan
+        schedules = source.get('schedules') or []
+        if isinstance(schedules, dict):
+            schedules = [schedules]
+        try:
+            starts = set(
+                to_day(item.get('start_date')) for item in schedules
+                if item.get('start_date')
+            )
+            next_start = source.get('next_start')
+            next_start = calendar.timegm(parse(next_start).timetuple()) * 1000 \
+                if next_start else MISSING
+        except (ValueError, OverflowError):
+            return None
+        starts = sorted(day for day in starts if day_from <= day <= day_to)
+        if not starts:
+            return None
+        category = source.get('category') or {}
+        return (
+            float(lat), float(lng), next_start,
+            category.get('slug'), bool(source.get('deleted')), starts,
+        )
+
+    def refresh(self, hits, since=None):
+        """
+        Rebuild from `(id, _source)` pairs of events starting in window,
+        `since` is `date_added` to start next `update` scan from.
+        """
+        day_from, day_to = (day.toordinal() for day in self.window())
+        docs = {}
+        for doc_id, source in hits:
+            row = self.parse(source, day_from, day_to)
+            if row is not None:
+                docs[doc_id] = row
+        self.docs = docs
+        self.today = day_from
+        self.since = since
+        self.rebuilt = self.updated = time.time()
+        self._build()
+        ids, _, _, columns = self.table
+        logger.debug('hotset: %s events, %s rows', len(ids), len(columns['event']))
+
+    def update(self, hits, since=None):
+        """
+        Upsert `(id, _source)` pairs of events changed since last scan.
+        """
+        day_from, day_to = (day.toordinal() for day in self.window())
+        changed = False
+        for doc_id, source in hits:
+            row = self.parse(source, day_from, day_to)
+            old = self.docs.get(doc_id)
+            if row is None:
+                if self.docs.pop(doc_id, None) is not None:
+                    changed = True
+                continue
+            self.docs[doc_id] = row
+            if old == row:
+                continue
+            if old is not None and old[:4] == row[:4] and old[5] == row[5]:
+                # only `deleted` flag changed, arrays keep their layout
+                self._mark(doc_id, row[4])
+            else:
+                changed = True
+        if changed:
+            self._build()
+        self.since = since or self.since
+        self.updated = time.time()
+
+    def discard(self, doc_id):
+        if doc_id in self.docs:
+            self.docs[doc_id] = self.docs[doc_id][:4] + \
+                (True,) + self.docs[doc_id][5:]
+            self._mark(doc_id, True)
+
+    def _mark(self, doc_id, deleted):
+        _, positions, _, columns = self.table
+        position = positions.get(doc_id)
+        if position is not None:
+            columns['deleted'][columns['event'] == position] = deleted
+
+    def _build(self):
+        ids, rows = [], []
+        categories = {}
+        for doc_id, (lat, lng, next_start, category, deleted, starts) in \
+                self.docs.items():
+            category_id = categories.setdefault(category, len(categories))
+            position = len(ids)
+            ids.append(doc_id)
+            for day in starts:
+                rows.append((
+                    lat, lng, day, next_start, category_id, deleted, position
+                ))
+
+        values = list(zip(*rows)) or [()] * 7
+        columns = {
+            name: np.array(column, dtype=dtype)
+            for (name, dtype), column in zip(COLUMNS, values)
+        }
+        positions = {doc_id: position for position, doc_id in enumerate(ids)}
+        # swapped at once, `search` running in other thread keeps old table
+        self.table = (ids, positions, categories, columns)
+
+    def match(self, spec, categories, columns):
+        """
+        Boolean mask of rows matching `spec` dates, radius and category.
+        """
+        day_from = to_day(spec.start_date)
+        day_to = to_day(spec.end_date or spec.start_date)
+        start = columns['start']
+        mask = ~columns['deleted'] & (start >= day_from) & (start <= day_to)
+
+        if spec.category_slug:
+            if spec.category_slug not in categories:
+                return np.zeros_like(mask)
+            mask &= columns['category'] == categories[spec.category_slug]
+
+        if spec.has_geo:
+            lat, lng = np.radians(float(spec.lat)), np.radians(float(spec.lng))
+            lats, lngs = np.radians(columns['lat']), np.radians(columns['lng'])
+            a = np.sin((lats - lat) / 2) ** 2 + \
+                np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+            distances = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+            # `NaN` distance of events without place is never in radius
+            with np.errstate(invalid='ignore'):
+                mask &= distances <= float(spec.radius)
+        return mask
+
+    def search(self, spec):
+        """
+        Return `(total, [(id, sort)])` page for `spec`,
+        `None` if spec dates can't be parsed.
+        """
+        ids, _, categories, columns = self.table
+        try:
+            mask = self.match(spec, categories, columns)
+        except (ValueError, OverflowError):
+            return None
+        positions, rows = np.unique(columns['event'][mask], return_index=True)
+        next_starts = columns['next_start'][mask][rows]
+
+        # `search_events` order: `next_start`, then `_uid`
+        found = sorted(
+            (next_start, '%s#%s' % (self.doc_type, ids[position]), ids[position])
+            for position, next_start in zip(
+                positions.tolist(), next_starts.tolist())
+        )
+        found = [(doc_id, [next_start, uid]) for next_start, uid, doc_id in found]
+
+        total = len(found)
+        if spec.search_after:
+            after = list(spec.search_after)
+            found = [item for item in found if item[1] > after]
+            return total, found[:spec.limit_to - spec.limit_from]
+        return total, found[spec.limit_from:spec.limit_to]
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+
+import re
+import math
+import sqlite3
+import logging
+import calendar
+import threading
+
+from datetime import date, timedelta
+from dateutil.parser import parse
+
+import ujson
+
+from django.conf import settings
+from elasticsearch.serializer import JSONSerializer
+
+from .geocells import EARTH_RADIUS, MISSING, distance, to_day
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    lat REAL,
+    lng REAL,
+    next_start INTEGER NOT NULL,
+    category_slug TEXT,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS schedules (
+    event_id TEXT NOT NULL,
+    start_day INTEGER,
+    end_day INTEGER
+);
+CREATE INDEX IF NOT EXISTS schedules_event ON schedules (event_id);
+CREATE INDEX IF NOT EXISTS schedules_start ON schedules (start_day);
+CREATE INDEX IF NOT EXISTS schedules_end ON schedules (end_day);
+CREATE INDEX IF NOT EXISTS events_order ON events (next_start, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS events_text USING fts5 (
+    id UNINDEXED, title, description, city, place_title, address
+);
+"""
+
+WORD = re.compile(r'\w+', re.UNICODE)
+# poor man's russian stemmer: query words match as prefixes without endings
+ENDING = re.compile(r'(?<=\w\w\w)[аеёиоуыэюяйь]+$', re.UNICODE)
+
+
+def add_year(day):
+    try:
+        return day.replace(year=day.year + 1)
+    except ValueError:
+        # 29 Feb
+        return day + timedelta(days=365)
+
+
+def match_query(q):
+    """
+    FTS5 query requiring every word of `q`, as prefix without ending.
+    One letter words (prepositions) are skipped like ES stopwords.
+    """
+    words = [
+        ENDING.sub('', word.lower()) for word in WORD.findall(q)
+        if len(word) > 1
+    ]
+    return ' AND '.join('"%s"*' % word for word in words)
+
+
+def filter_source(source, includes):
+    """
+    `_source` with only `includes` dotted paths, as ES `_source_include`.
+    """
+    if not includes:
+        return source
+    result = {}
+    for path in includes:
+        head, _, rest = path.partition('.')
+        if head not in source:
+            continue
+        value = source[head]
+        if not rest:
+            result[head] = value
+        elif isinstance(value, dict):
+            inner = filter_source(value, [rest])
+            if inner:
+                result.setdefault(head, {}).update(inner)
+        elif isinstance(value, list):
+            inner = [
+                filter_source(item, [rest]) for item in value
+                if isinstance(item, dict)
+            ]
+            current = result.setdefault(head, [{} for _ in inner])
+            for item, extra in zip(current, inner):
+                item.update(extra)
+    return result
+
+
+class LocalEventIndex(object):
+    """
+    Embedded `search_events` backend on SQLite with FTS5 for small
+    deployments, CI and benchmarks: no ES cluster, deterministic hits.
+
+    Loads the documents `BaseEventSerializer` produces (the same
+    `bulk_index` sends to ES) and answers `EventSearchSpec` with the
+    same filters and (`next_start`, `_uid`) order: deleted flag and
+    schedule days in `schedules` table, radius as bounding box plus
+    exact distance, `q` as FTS5 prefix match of all its words across
+    text fields. `mget` returns `_mget`-like docs, so responses are
+    built exactly as from ES.
+
+    Writes through `Event` and `ElasticsearchMixin` to its index are
+    mirrored here (see `get_local_index`), writes of other processes
+    need a reload with `load_local_search` script.
+    """
+
+    def __init__(self, path=':memory:', index='event-index', doc_type='events'):
+        self.path = path
+        self.index = index
+        self.doc_type = doc_type
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.create_function('distance', 4, distance)
+        self.db.executescript(SCHEMA)
+        self.serializer = JSONSerializer()
+
+    def can_answer(self, spec):
+        return True
+
+    def get_row(self, doc_id, doc):
+        place = doc.get('place') or {}
+        category = doc.get('category') or {}
+        next_start = doc.get('next_start')
+        if next_start:
+            if not hasattr(next_start, 'timetuple'):
+                next_start = parse(next_start)
+            next_start = calendar.timegm(next_start.timetuple()) * 1000
+        return (
+            doc_id,
+            self.serializer.dumps(doc),
+            place.get('lat') or None,
+            place.get('lng') or None,
+            next_start or MISSING,
+            category.get('slug'),
+            1 if doc.get('deleted') else 0,
+        )
+
+    def load(self, hits):
+        """
+        Replace documents of `(id, doc)` pairs, return their count.
+        """
+        count = 0
+        with self.lock, self.db:
+            for doc_id, doc in hits:
+                self.insert_rows(doc_id, doc)
+                count += 1
+        logger.debug('local index: %s events loaded', count)
+        return count
+
+    def load_file(self, path):
+        """
+        Load JSON lines file of serialized event documents with ids
+        `bulk_index` gives them, documents without `provider_id` have
+        no stable id and are skipped.
+        """
+        from .mixins import ElasticsearchMixin
+
+        with open(path, encoding='utf-8') as source:
+            docs = (ujson.loads(line) for line in source if line.strip())
+            return self.load(
+                (ElasticsearchMixin.get_document_id(doc), doc)
+                for doc in docs if doc.get('provider_id')
+            )
+
+    def upsert(self, doc_id, fields):
+        """
+        Partial update of `doc_id` with `fields`, as ES `update`
+        with `doc_as_upsert`.
+        """
+        with self.lock, self.db:
+            row = self.db.execute(
+                'SELECT source FROM events WHERE id = ?', (doc_id,)
+            ).fetchone()
+            doc = ujson.loads(row[0]) if row else {}
+            doc.update(fields)
+            self.insert_rows(doc_id, doc)
+
+    def mirror(self, actions):
+        """
+        Pass `bulk_index` `(action, doc)` pairs through,
+        applying them here on the way.
+        """
+        for action, doc in actions:
+            (op_type, info), = action.items()
+            if op_type == 'delete':
+                self.delete(info['_id'])
+            elif doc is not None:
+                self.upsert(info['_id'], doc.get('doc', doc))
+            yield action, doc
+
+    def insert_rows(self, doc_id, doc):
+        self.delete_rows(doc_id)
+        self.db.execute(
+            'INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?)',
+            self.get_row(doc_id, doc)
+        )
+        schedules = doc.get('schedules') or []
+        if isinstance(schedules, dict):
+            schedules = [schedules]
+        self.db.executemany(
+            'INSERT INTO schedules VALUES (?, ?, ?)',
+            [
+                (doc_id,
+                 to_day(item.get('start_date')),
+                 to_day(item.get('end_date')))
+                for item in schedules
+            ]
+        )
+        place = doc.get('place') or {}
+        self.db.execute(
+            'INSERT INTO events_text VALUES (?, ?, ?, ?, ?, ?)',
+            (doc_id, doc.get('title'), doc.get('description'),
+             place.get('city'), place.get('title'),
+             place.get('address'))
+        )
+
+    def delete_rows(self, doc_id):
+        self.db.execute('DELETE FROM events WHERE id = ?', (doc_id,))
+        self.db.execute('DELETE FROM schedules WHERE event_id = ?', (doc_id,))
+        self.db.execute('DELETE FROM events_text WHERE id = ?', (doc_id,))
+
+    def delete(self, doc_id):
+        with self.lock, self.db:
+            self.delete_rows(doc_id)
+
+    def get_where(self, spec):
+        # same filters as `EventSearchSpec.get_filters`
+        where, params = ['deleted = 0'], []
+        today = date.today()
+        if not spec.start_date:
+            where.append(
+                'id IN (SELECT event_id FROM schedules '
+                'WHERE end_day BETWEEN ? AND ?)'
+            )
+            params.extend([today.toordinal(), add_year(today).toordinal()])
+
+        day_from = to_day(spec.start_date or spec.end_date)
+        day_to = to_day(spec.end_date or spec.start_date)
+        if day_from:
+            where.append(
+                'id IN (SELECT event_id FROM schedules '
+                'WHERE start_day BETWEEN ? AND ?)'
+            )
+            params.extend([day_from, day_to])
+
+        if spec.category_slug:
+            where.append('category_slug = ?')
+            params.append(spec.category_slug)
+
+        if spec.has_geo:
+            lat, lng = float(spec.lat), float(spec.lng)
+            radius = float(spec.radius)
+            dlat = math.degrees(radius / EARTH_RADIUS)
+            dlng = dlat / max(math.cos(math.radians(lat)), 0.01)
+            where.append(
+                'lat BETWEEN ? AND ? AND lng BETWEEN ? AND ? '
+                'AND distance(?, ?, lat, lng) <= ?'
+            )
+            params.extend([
+                lat - dlat, lat + dlat, lng - dlng, lng + dlng,
+                lat, lng, radius
+            ])
+
+        if spec.q:
+            query = match_query(spec.q)
+            if query:
+                where.append(
+                    'id IN (SELECT id FROM events_text '
+                    'WHERE events_text MATCH ?)'
+                )
+                params.append(query)
+        return where, params
+
+    def search(self, spec):
+        """
+        Return `(total, [(id, sort)])` page for `spec`,
+        `None` if spec dates can't be parsed.
+        """
+        try:
+            where, params = self.get_where(spec)
+        except (ValueError, OverflowError):
+            return None
+        where = ' AND '.join(where)
+
+        with self.lock:
+            total = self.db.execute(
+                'SELECT COUNT(*) FROM events WHERE %s' % where, params
+            ).fetchone()[0]
+
+            limit = spec.limit_to - spec.limit_from
+            offset = spec.limit_from
+            if spec.search_after:
+                next_start, uid = spec.search_after
+                where += ' AND (next_start, id) > (?, ?)'
+                params = params + [next_start, uid.split('#', 1)[-1]]
+                offset = 0
+            rows = self.db.execute(
+                'SELECT id, next_start FROM events WHERE %s '
+                'ORDER BY next_start, id LIMIT ? OFFSET ?' % where,
+                params + [max(limit, 0), offset]
+            ).fetchall()
+
+        return total, [
+            (doc_id, [next_start, '%s#%s' % (self.doc_type, doc_id)])
+            for doc_id, next_start in rows
+        ]
+
+    def mget(self, ids, includes=None):
+        """
+        `_mget` response docs for `ids`, `_source` limited to `includes`.
+        """
+        marks = ', '.join('?' * len(ids))
+        with self.lock:
+            sources = dict(self.db.execute(
+                'SELECT id, source FROM events WHERE id IN (%s)' % marks, ids
+            ).fetchall())
+        docs = []
+        for doc_id in ids:
+            doc = {
+                '_index': self.index,
+                '_type': self.doc_type,
+                '_id': doc_id,
+                'found': doc_id in sources,
+            }
+            if doc['found']:
+                doc['_source'] = filter_source(
+                    ujson.loads(sources[doc_id]), includes
+                )
+            docs.append(doc)
+        return docs
+
+
+_local_index = None
+
+
+def get_local_index(index=None):
+    """
+    Shared `LocalEventIndex` of the process when `EVENT_LOCAL_SEARCH`
+    is set, `None` means `search_events` goes to ES.
+    With `index` only if the local index mirrors it.
+    """
+    global _local_index
+    options = getattr(settings, 'EVENT_LOCAL_SEARCH', None)
+    if _local_index is None and options is not None:
+        _local_index = LocalEventIndex(**options)
+    if index is not None and _local_index is not None and \
+            _local_index.index != index:
+        return None
+    return _local_index
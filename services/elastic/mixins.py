@@ -5,6 +5,9 @@ from elasticsearch import Elasticsearch, TransportError
 
 from django.conf import settings
 from . exceptions import MissingObjectError
+from . cache import invalidate
+from . bulk import BulkIndexer
+from . local import get_local_index
 
 
 class ElasticsearchMixin(object):
@@ -49,14 +52,7 @@ class ElasticsearchMixin(object):
         return True
 
     @classmethod
-    def bulk_index(cls, es=None, index_name='', queryset=None, refresh=True):
-        es = es or cls.get_es()
-
-        tmp = []
-
-        if not queryset:
-            return
-
+    def get_bulk_actions(cls, queryset, index_name=''):
         for obj in queryset:
             delete = not cls.should_index(obj)
 
@@ -77,15 +73,36 @@ class ElasticsearchMixin(object):
             data.update(cls.get_request_params(obj))
             data = {'delete' if delete else 'update': data}
 
-            # bulk operation instructions/details
-            tmp.append(data)
+            # bulk operation instructions/details, only followed by
+            # operation data if it's not a delete operation
+            if delete:
+                yield data, None
+            else:
+                yield data, {'doc': doc, 'doc_as_upsert': True}
 
-            # only append bulk operation data if it's not a delete operation
-            if not delete:
-                tmp.append({'doc': doc, 'doc_as_upsert': True})
+    @classmethod
+    def bulk_index(cls, es=None, index_name='', queryset=None, refresh=True,
+                   **options):
+        """
+        Index any iterable of objects with `BulkIndexer` in chunks,
+        `options` are `BulkIndexer` params. Index is refreshed once at
+        the end if `refresh`. Return per-item stats.
+        """
+        es = es or cls.get_es()
+
+        if queryset is None:
+            return
 
-        if tmp:
-            es.bulk(tmp, refresh=refresh)
+        actions = cls.get_bulk_actions(queryset, index_name)
+        local_index = get_local_index(index_name or cls.get_index_name())
+        if local_index is not None:
+            actions = local_index.mirror(actions)
+        stats = BulkIndexer(es, **options).run(actions)
+        if stats['success'] or stats['failed']:
+            if refresh:
+                es.indices.refresh(index=index_name or cls.get_index_name())
+            invalidate(index_name or cls.get_index_name())
+        return stats
 
     @classmethod
     def index_add(cls, obj, index_name=''):
@@ -94,14 +111,18 @@ class ElasticsearchMixin(object):
             if not doc:
                 return False
 
+            # once: it's random without `provider_id`
+            doc_id = cls.get_document_id(obj)
             instance = cls.get_es().index(
                 index_name or cls.get_index_name(),
                 cls.get_type_name(),
                 doc,
-                cls.get_document_id(obj),
+                doc_id,
                 refresh=True,
                 **cls.get_request_params(obj)
             )
+            cls.write_local(index_name, doc_id, doc)
+            invalidate(index_name or cls.get_index_name())
             return instance
         return False
 
@@ -121,6 +142,10 @@ class ElasticsearchMixin(object):
                 refresh=True,
                 **cls.get_request_params(obj)
             )
+            cls.write_local(
+                index_name, cls.get_document_id(obj), doc, partial=True
+            )
+            invalidate(index_name or cls.get_index_name())
             return instance
         return False
 
@@ -137,9 +162,28 @@ class ElasticsearchMixin(object):
             except TransportError as e:
                 if e.status_code != 404:
                     raise
+            cls.write_local(index_name, cls.get_document_id(obj), None)
+            invalidate(index_name or cls.get_index_name())
             return True
         return False
 
+    @classmethod
+    def write_local(cls, index_name, doc_id, doc, partial=False):
+        """
+        Repeat write to `EVENT_LOCAL_SEARCH` index if it mirrors this
+        one: `doc` replaces the document (or updates its fields if
+        `partial`), `None` deletes it.
+        """
+        local_index = get_local_index(index_name or cls.get_index_name())
+        if local_index is None:
+            return
+        if doc is None:
+            local_index.delete(doc_id)
+        elif partial:
+            local_index.upsert(doc_id, doc)
+        else:
+            local_index.load([(doc_id, doc)])
+
     @classmethod
     def index_add_or_delete(cls, obj, index_name=''):
         if obj:
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import ujson
+
 from datetime import datetime
 from django.utils import timezone
 from django.conf import settings
 
+from elasticsearch.helpers import scan
 from elasticsearch_dsl.connections import connections
 
 from elasticsearch_dsl import (
@@ -13,9 +17,28 @@ from elasticsearch_dsl import (
     InnerObjectWrapper, Completion, Keyword, Text
 )
 
+from .aio import get_transport
+from .cache import SearchCache, invalidate
+from .records import RawResponse, FILTER_PATH
+from .search import EventSearchSpec
+from .geocells import GeoCellIndex
+from .hotset import HotSet
+from .local import get_local_index
+
 # configure default ES connection
 connections.configure(default=settings.ELASTICSEARCH_CONNECTION_PARAMS)
 
+search_cache = SearchCache(
+    'event-index',
+    **getattr(settings, 'EVENT_SEARCH_CACHE', {})
+)
+
+# radius queries without `q`, filled by `Event.refresh_geocells`
+geocells = GeoCellIndex(**getattr(settings, 'EVENT_GEOCELLS', {}))
+
+# dated queries without `q` within next week, see `Event.refresh_hotset`
+hotset = HotSet(**getattr(settings, 'EVENT_HOTSET', {}))
+
 
 class Schedule(InnerObjectWrapper):
     @property
@@ -194,6 +217,12 @@ class Event(DocType):
     is_free = Boolean()
     currency = String()
     formatted_price = String()
+    # precomputed by `BaseEventSerializer` for chat bot
+    chat_card = Text(index=False)
+    next_start = Date(
+        format="YYYY-MM-dd||"
+        "YYYY-MM-dd'T'HH:mm:ss"
+    )
 
     class Meta:
         doc_type = 'events'
@@ -202,10 +231,42 @@ class Event(DocType):
     def save(self, **kwargs):
         if not self.date_added:
             self.date_added = datetime.now()
-        return super(Event, self).save(**kwargs)
+        result = super(Event, self).save(**kwargs)
+        local_index = get_local_index(self._doc_type.index)
+        if local_index is not None:
+            local_index.load([(self.meta.id, self.to_dict())])
+        invalidate(self._doc_type.index)
+        return result
+
+    def update(self, **fields):
+        result = super(Event, self).update(**fields)
+        local_index = get_local_index(self._doc_type.index)
+        if local_index is not None:
+            local_index.upsert(self.meta.id, {
+                name: value for name, value in fields.items()
+                if name not in ('using', 'index')
+            })
+        # cached hits share `attach` with updated event,
+        # photo reuploads are cheap: `PhotoUploader` caches by url
+        if set(fields) - {'attach', 'using', 'index'}:
+            invalidate(self._doc_type.index)
+        if fields.get('deleted'):
+            hotset.discard(self.meta.id)
+            geocells.discard(self.meta.id)
+        return result
+
+    def delete(self, **kwargs):
+        result = super(Event, self).delete(**kwargs)
+        local_index = get_local_index(self._doc_type.index)
+        if local_index is not None:
+            local_index.delete(self.meta.id)
+        invalidate(self._doc_type.index)
+        hotset.discard(self.meta.id)
+        geocells.discard(self.meta.id)
+        return result
 
     @classmethod
-    def search_events(cls, limit=100, **kwargs):
+    def search_events(cls, limit=100, spec=None, **kwargs):
         """
         Build ES query fillter by `kwargs` params.
         kwargs = {
@@ -215,79 +276,226 @@ class Event(DocType):
             'radius': 0,
             'lat': 0.0,
             'lng': 0.0,
+            'category_slug': 'slug',
             'actual': False,
+            'search_after': [sort values of last hit],
+            'projection': 'full',  # key of `PROJECTIONS`
+            'request_cache': False,
+            'raw': False,  # `RawResponse` of `EventCard` records
+            'cache': True,
             ....
         }
+        or `spec=EventSearchSpec(...)`, see `EventSearchSpec` for
+        query structure.
+        Executed searches are cached in `search_cache`,
+        pass `cache=False` to skip it.
         """
-        search = cls.search()
-        search = search.exclude('term', deleted=True)
-
+        if spec is not None:
+            kwargs = dict(kwargs, **spec.as_kwargs())
         observable = kwargs.get('observable', False)
-        start_date = kwargs.get('start_date', None)
-        end_date = kwargs.get('end_date', None)
+        spec = EventSearchSpec.from_kwargs(**kwargs)
+        search = spec.compile(cls.search())
+        if observable:
+            return search
+
+        use_cache = kwargs.get('cache', True)
+        key = search_cache.key(kwargs)
+        response = search_cache.get(key) if use_cache else None
+        if response is None:
+            page = cls.search_local(spec)
+            if page is not None:
+                total, found = page
+                docs = cls.get_es_docs(
+                    search, [doc_id for doc_id, _ in found]
+                ) if found else []
+                response = cls.geocells_response(
+                    search, total, found, docs, kwargs.get('raw', False)
+                )
+            elif kwargs.get('raw', False):
+                response = cls.execute_raw(search)
+            else:
+                response = search.execute()
+            if use_cache:
+                search_cache.set(key, response)
+        return response
 
-        limit_from = kwargs.get('limit_from', 0)
-        limit_to = kwargs.get('limit_to', 18)
+    @classmethod
+    def search_local(cls, spec):
+        """
+        `(total, [(id, sort)])` page from embedded `LocalEventIndex`
+        (when `EVENT_LOCAL_SEARCH` is set), in-process `hotset` or
+        `geocells` index, `None` if none of them can answer `spec`.
+        """
+        for index in (get_local_index(), hotset, geocells):
+            if index is not None and index.can_answer(spec):
+                page = index.search(spec)
+                if page is not None:
+                    return page
+        return None
 
-        if not start_date:
-            search = search.query(
-                'range',
-                **{'schedules.end_date': {
-                    'lte': 'now+1y/d',
-                    'gte': 'now/d'
-                }}
-            )
+    @classmethod
+    def get_source_params(cls, search):
+        source = search.to_dict().get('_source', None)
+        if isinstance(source, dict) and source.get('includes'):
+            return {'_source_include': ','.join(source['includes'])}
+        return {}
 
-        if 'q' in kwargs and kwargs['q']:
-            search = search.query(
-                'multi_match',
-                query=kwargs['q'],
-                type='most_fields',
-                minimum_should_match='75%',
-                operator='and',
-                tie_breaker=0.8,
-                fields=['title^4', 'description',
-                        'place.city', 'place.title^2', 'place.address']
-            )
+    @classmethod
+    def get_es_docs(cls, search, ids):
+        local_index = get_local_index()
+        if local_index is not None:
+            includes = cls.get_source_params(search).get('_source_include')
+            return local_index.mget(ids, includes and includes.split(','))
+        es = connections.get_connection(search._using or 'default')
+        result = es.mget(
+            body={'ids': ids},
+            index=cls._doc_type.index,
+            doc_type=cls._doc_type.name,
+            **cls.get_source_params(search)
+        )
+        return result['docs']
 
-        if start_date and end_date:
-            search = search.query(
-                'range',
-                **{'schedules.start_date': {
-                    'gte': '{start_date}||/d'.format(**kwargs),
-                    'lte': '{end_date}||/d'.format(**kwargs)
-                }}
-            )
+    @classmethod
+    def geocells_response(cls, search, total, found, docs, raw=False):
+        """
+        ES-like response from `search_local` page and `_mget` docs.
+        """
+        hits = []
+        for (doc_id, sort), doc in zip(found, docs):
+            if not doc.get('found'):
+                continue
+            hits.append({
+                '_index': doc['_index'],
+                '_type': doc['_type'],
+                '_id': doc_id,
+                '_source': doc.get('_source', {}),
+                'sort': sort,
+            })
+        data = {'hits': {'total': total, 'hits': hits}}
+        if raw:
+            return RawResponse(data)
+        return search._response_class(search, data)
 
-        elif start_date:
-            search = search.query(
-                'range',
-                **{'schedules.start_date': {
-                    'gte': '{start_date}||/d'.format(**kwargs),
-                    'lte': '{start_date}||/d'.format(**kwargs)
-                }}
-            )
-        elif end_date:
-            search = search.query(
+    @classmethod
+    def refresh_geocells(cls):
+        """
+        Rebuild `geocells` from upcoming events, blocking.
+        """
+        search = cls.search()
+        search = search.query('bool', filter=EventSearchSpec().get_filters())
+        search = search.source(GeoCellIndex.source_fields())
+        geocells.refresh(cls.scan_sources(search))
+
+    @classmethod
+    def scan_sources(cls, search):
+        """
+        `(id, _source)` pairs of all `search` hits, dates left as
+        strings, no DocType hydration.
+        """
+        es = connections.get_connection(search._using or 'default')
+        for hit in scan(
+                es,
+                query=search.to_dict(),
+                index=cls._doc_type.index,
+                doc_type=cls._doc_type.name):
+            yield hit['_id'], hit.get('_source', {})
+
+    @classmethod
+    def refresh_hotset(cls):
+        """
+        Update `hotset` with events added since last call, rebuild it
+        once a day and every `rebuild_interval` seconds, blocking.
+        """
+        started = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        search = cls.search().source(HotSet.source_fields())
+        if hotset.needs_rebuild:
+            today, last_day = hotset.window()
+            search = search.query('bool', filter=[Q(
                 'range',
                 **{'schedules.start_date': {
-                    'gte': '{end_date}||/d'.format(**kwargs),
-                    'lte': '{end_date}||/d'.format(**kwargs)
+                    'gte': today.isoformat(),
+                    'lte': '%s||/d' % last_day.isoformat()
                 }}
-            )
+            )])
+            hotset.refresh(cls.scan_sources(search), since=started)
+        else:
+            # deleted and moved events too, `update` drops them
+            search = search.query('bool', filter=[Q(
+                'range', date_added={'gte': hotset.since}
+            )])
+            hotset.update(cls.scan_sources(search), since=started)
 
-        if 'radius' in kwargs and 'lat' in kwargs and 'lng' in kwargs:
-            search = search.query('bool', filter=Q(
-                'geo_distance',
-                distance='{radius}m'.format(**kwargs),
-                **{'place.geometry': {
-                    'lat': kwargs['lat'], 'lon': kwargs['lng']
-                }}
-            ))
+    @classmethod
+    def execute_raw(cls, search):
+        """
+        Send `search` with low level connection and decode response body
+        with ujson into `RawResponse`, skipping DocType hydration.
+        """
+        es = connections.get_connection(search._using or 'default')
+        params = dict(search._params, filter_path=FILTER_PATH)
+        status, headers, raw_data = es.transport.get_connection().perform_request(
+            'POST',
+            '/%s/%s/_search' % (cls._doc_type.index, cls._doc_type.name),
+            params,
+            ujson.dumps(search.to_dict())
+        )
+        return RawResponse.loads(raw_data)
 
-        search = search.sort('schedules.start_date')
-        search = search[limit_from:limit_to]
-        return search if observable else search.execute()
+    @classmethod
+    @asyncio.coroutine
+    def search_events_async(cls, transport=None, spec=None, **kwargs):
+        """
+        Awaitable `search_events`: same query and hits, sent with
+        pooled aiohttp `AsyncTransport` instead of blocking client.
+        """
+        if spec is not None:
+            kwargs = dict(kwargs, **spec.as_kwargs())
+        use_cache = kwargs.get('cache', True)
+        key = search_cache.key(kwargs)
+        response = search_cache.get(key) if use_cache else None
+        if response is not None:
+            return response
+
+        spec = EventSearchSpec.from_kwargs(**kwargs)
+        search = spec.compile(cls.search())
+        transport = transport or get_transport()
+        page = cls.search_local(spec)
+        if page is not None:
+            total, found = page
+            docs = []
+            if found and get_local_index() is not None:
+                docs = cls.get_es_docs(search, [doc_id for doc_id, _ in found])
+            elif found:
+                result = yield from transport.perform_request(
+                    'POST',
+                    '/%s/%s/_mget' % (cls._doc_type.index, cls._doc_type.name),
+                    params=cls.get_source_params(search),
+                    body={'ids': [doc_id for doc_id, _ in found]}
+                )
+                docs = result['docs']
+            response = cls.geocells_response(
+                search, total, found, docs, kwargs.get('raw', False)
+            )
+            if use_cache:
+                search_cache.set(key, response)
+            return response
+
+        params = dict(search._params)
+        if kwargs.get('raw', False):
+            params['filter_path'] = FILTER_PATH
+        raw = yield from transport.search(
+            cls._doc_type.index,
+            cls._doc_type.name,
+            search.to_dict(),
+            params=params
+        )
+        if kwargs.get('raw', False):
+            response = RawResponse(raw)
+        else:
+            response = search._response_class(search, raw)
+        if use_cache:
+            search_cache.set(key, response)
+        return response
 
 
 class Collection(DocType):
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import ujson
+
+from datetime import datetime
+
+# only what `EventCard` reads, ES drops the rest of response
+FILTER_PATH = 'hits.total,hits.hits._id,hits.hits._source,hits.hits.sort'
+
+DATE_FORMATS = {
+    10: '%Y-%m-%d',
+    16: '%Y-%m-%dT%H:%M',
+    19: '%Y-%m-%dT%H:%M:%S',
+}
+
+
+def format_card(title, place_title, start=None, end=None, description=''):
+    """
+    Text of event card sent by chat bot.
+    """
+    if start:
+        start = 'Начало - %s' % start.strftime('%d.%m.%Y %H:%M')
+    if end:
+        end = 'Окончание - %s' % end.strftime('%d.%m.%Y %H:%M')
+    return '%s \n %s \n %s \n %s \n %s' % (
+        title, 'Место - %s' % place_title,
+        start or '', end or '',
+        (description or '')[:100]
+    )
+
+
+def parse_date(value):
+    if not value:
+        return None
+    value = value[:19]
+    return datetime.strptime(value, DATE_FORMATS.get(len(value), '%Y-%m-%d'))
+
+
+class EventCard(object):
+    """
+    Compact read-only event hit for `search_events(raw=True)`: plain
+    slots filled straight from `_source`, no `Event` DocType and inner
+    wrappers hydration.
+    """
+    __slots__ = (
+        'id', 'sort', 'title', 'description', 'image', 'attach',
+        'place_title', 'lat', 'lng', 'start_date', 'end_date', 'chat_card',
+    )
+
+    def __init__(self, hit):
+        source = hit.get('_source', {})
+        place = source.get('place') or {}
+        dates = source.get('dates') or []
+        date = dates[0] if isinstance(dates, list) and dates else {}
+        if isinstance(dates, dict):
+            date = dates
+
+        self.id = hit['_id']
+        self.sort = hit.get('sort')
+        self.title = source.get('title')
+        self.description = source.get('description')
+        self.image = source.get('image')
+        self.attach = source.get('attach')
+        self.place_title = place.get('title')
+        self.lat = place.get('lat')
+        self.lng = place.get('lng')
+        self.start_date = parse_date(date.get('start_date'))
+        self.end_date = parse_date(date.get('end_date'))
+        self.chat_card = source.get('chat_card')
+
+    @property
+    def text(self):
+        if self.chat_card:
+            return self.chat_card
+        return format_card(
+            self.title, self.place_title,
+            self.start_date, self.end_date,
+            self.description
+        )
+
+
+class RawResponse(object):
+    __slots__ = ('total', 'hits')
+
+    def __init__(self, data):
+        hits = data.get('hits', {})
+        self.total = hits.get('total', 0)
+        self.hits = [EventCard(hit) for hit in hits.get('hits', [])]
+
+    @classmethod
+    def loads(cls, raw_data):
+        return cls(ujson.loads(raw_data))
+
+    def __iter__(self):
+        return iter(self.hits)
+
+    def __len__(self):
+        return len(self.hits)
+
+    def __getitem__(self, key):
+        return self.hits[key]
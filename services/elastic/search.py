@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+
+from elasticsearch_dsl import Q
+
+# `_source` filters for `EventSearchSpec.projection`
+PROJECTIONS = {
+    'full': None,
+    # fields used by `VKChat.send_card`
+    'chat_card': {
+        'includes': [
+            'title',
+            'description',
+            'image',
+            'attach',
+            'place.title',
+            'place.lat',
+            'place.lng',
+            'dates.start_date',
+            'dates.end_date',
+            'chat_card',
+        ],
+    },
+}
+
+TEXT_FIELDS = [
+    'title^4', 'description',
+    'place.city', 'place.title^2', 'place.address'
+]
+
+
+class EventSearchSpec(object):
+    """
+    Structured `Event.search_events` query.
+
+    Only `q` is scored; deleted flag, date ranges and geo distance are
+    compiled into `bool.filter`, so ES skips scoring them and caches
+    them in node query cache. Date math is rounded to days and anchored
+    on client's today (`<date>||/d`, `<date>||+1y/d`), never `now`:
+    ES doesn't keep requests using `now` in request cache, so with
+    `request_cache=True` param repeated searches of the day are cached.
+    """
+
+    def __init__(self, q=None, start_date=None, end_date=None,
+                 lat=None, lng=None, radius=None, category_slug=None,
+                 limit_from=0, limit_to=18, search_after=None,
+                 projection=None, request_cache=False):
+        self.q = q
+        self.start_date = start_date
+        self.end_date = end_date
+        self.lat = lat
+        self.lng = lng
+        self.radius = radius
+        self.category_slug = category_slug
+        self.limit_from = limit_from
+        self.limit_to = limit_to
+        self.search_after = search_after
+        self.projection = projection or 'full'
+        self.request_cache = request_cache
+
+    @classmethod
+    def from_kwargs(cls, **kwargs):
+        """
+        Spec from old `search_events` kwargs.
+        """
+        spec = cls(
+            # `VKChat` joins empty genre and category into ' '
+            q=(kwargs.get('q', None) or '').strip() or None,
+            start_date=kwargs.get('start_date', None),
+            end_date=kwargs.get('end_date', None),
+            # `category` of `VKChat` is free text, it goes to `q`
+            category_slug=kwargs.get('category_slug', None),
+            limit_from=kwargs.get('limit_from', 0),
+            limit_to=kwargs.get('limit_to', 18),
+            search_after=kwargs.get('search_after', None),
+            projection=kwargs.get('projection', None),
+            request_cache=kwargs.get('request_cache', False),
+        )
+        if 'radius' in kwargs and 'lat' in kwargs and 'lng' in kwargs:
+            spec.lat = kwargs['lat']
+            spec.lng = kwargs['lng']
+            spec.radius = kwargs['radius']
+        return spec
+
+    def as_kwargs(self):
+        kwargs = {
+            name: value for name, value in vars(self).items()
+            if value is not None
+        }
+        if self.radius is None:
+            kwargs.pop('lat', None)
+            kwargs.pop('lng', None)
+        return kwargs
+
+    @property
+    def has_geo(self):
+        return self.radius is not None and \
+            self.lat is not None and self.lng is not None
+
+    def get_filters(self):
+        filters = [~Q('term', deleted=True)]
+
+        if not self.start_date:
+            # today of `SearchCache.key`, not `now`: see class docs
+            today = date.today().isoformat()
+            filters.append(Q(
+                'range',
+                **{'schedules.end_date': {
+                    'lte': '%s||+1y/d' % today,
+                    'gte': '%s||/d' % today
+                }}
+            ))
+
+        day_from = day_to = None
+        if self.start_date and self.end_date:
+            day_from, day_to = self.start_date, self.end_date
+        elif self.start_date:
+            day_from = day_to = self.start_date
+        elif self.end_date:
+            day_from = day_to = self.end_date
+        if day_from:
+            filters.append(Q(
+                'range',
+                **{'schedules.start_date': {
+                    'gte': '%s||/d' % day_from,
+                    'lte': '%s||/d' % day_to
+                }}
+            ))
+
+        if self.category_slug:
+            filters.append(Q(
+                'term', **{'category.slug.raw': self.category_slug}
+            ))
+
+        if self.has_geo:
+            filters.append(Q(
+                'geo_distance',
+                distance='%sm' % self.radius,
+                **{'place.geometry': {
+                    'lat': self.lat, 'lon': self.lng
+                }}
+            ))
+        return filters
+
+    def get_query(self):
+        must = []
+        if self.q:
+            must.append(Q(
+                'multi_match',
+                query=self.q,
+                type='most_fields',
+                minimum_should_match='75%',
+                operator='and',
+                tie_breaker=0.8,
+                fields=TEXT_FIELDS
+            ))
+        return Q('bool', must=must, filter=self.get_filters())
+
+    def compile(self, search):
+        search = search.query(self.get_query())
+
+        projection = PROJECTIONS[self.projection]
+        if projection:
+            search = search.source(**projection)
+
+        # single valued `next_start` is cheaper to sort than
+        # `schedules.start_date`, `_uid` makes `search_after` cursor unique;
+        # `unmapped_type`: index created before `next_start` sorts all
+        # docs as missing it instead of failing until `Event.init()`
+        search = search.sort(
+            {'next_start': {'order': 'asc', 'unmapped_type': 'date'}},
+            '_uid'
+        )
+        if self.search_after:
+            # page after cursor, ES requires `from` to be 0
+            search = search.extra(search_after=list(self.search_after))
+            search = search[0:self.limit_to - self.limit_from]
+        else:
+            search = search[self.limit_from:self.limit_to]
+
+        if self.request_cache:
+            search = search.params(request_cache=True)
+        return search
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import logging
+import threading
+
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def serialize(items, serializer_class):
+    """
+    Serialized documents of `items`, broken items are logged and skipped.
+    """
+    for item in items:
+        try:
+            yield serializer_class.fast_data(item)
+        except Exception:
+            logger.exception('skip broken %s item', serializer_class.__name__)
+
+
+def serialize_chunk(serializer_class, items):
+    # runs in worker process
+    return list(serialize(items, serializer_class))
+
+
+class ParallelSerializer(object):
+    """
+    Serialize stream of provider items on `workers` processes.
+
+    A feeder thread cuts items into chunks of `chunk_size` and submits
+    them to `ProcessPoolExecutor`; futures go through a queue of
+    `queue_size`, which blocks the feeder when the consumer (bulk
+    indexer) is behind. Serialized documents come out in items order,
+    at most `queue_size + 1` chunks are in memory at once.
+
+        docs = ParallelSerializer(EventSerializer, workers=4)(items)
+        EventSerializer.bulk_index(queryset=docs)
+    """
+
+    def __init__(self, serializer_class, workers=None, chunk_size=200,
+                 queue_size=None):
+        self.serializer_class = serializer_class
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size or 2 * (workers or 4)
+
+    def put(self, results, value, stop):
+        while not stop.is_set():
+            try:
+                results.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def feed(self, executor, items, results, stop):
+        try:
+            for chunk in chunked(items, self.chunk_size):
+                future = executor.submit(
+                    serialize_chunk, self.serializer_class, chunk
+                )
+                if not self.put(results, future, stop):
+                    future.cancel()
+                    return
+        except Exception as e:
+            # reading items failed, re-raised by consumer
+            self.put(results, e, stop)
+            return
+        self.put(results, None, stop)
+
+    def __call__(self, items):
+        results = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        with ProcessPoolExecutor(self.workers) as executor:
+            feeder = threading.Thread(
+                target=self.feed,
+                args=(executor, items, results, stop),
+                daemon=True
+            )
+            feeder.start()
+            try:
+                while True:
+                    future = results.get()
+                    if future is None:
+                        break
+                    if isinstance(future, Exception):
+                        raise future
+                    for doc in future.result():
+                        yield doc
+            finally:
+                stop.set()
+                feeder.join()
@@ -1,15 +1,117 @@
 # -*- coding: utf-8 -*-
 
+import re
+
 from uuid import uuid4
 from datetime import datetime
+from functools import lru_cache
 from dateutil.parser import parse
 
 from rest_framework import serializers
+from rest_framework.fields import SkipField
 
 from services.elastic.mixins import ElasticsearchMixin
+from services.elastic.records import format_card
+
+# `YYYY-MM-DD[THH:MM[:SS]]`, naive; anything else goes to dateutil
+ISO_DATETIME = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::(\d{2}))?)?$'
+)
+# ISO day first, its string orders as the date (offset doesn't move it)
+ISO_DAY = re.compile(r'\d{4}-\d{2}-\d{2}(?:[T ]|$)')
+# actual dates kept per event
+MAX_DATES = 300
+
+
+@lru_cache(maxsize=16384)
+def parse_datetime(value):
+    """
+    Memoized `dateutil.parser.parse` with fast path for naive ISO
+    strings, feeds repeat the same schedule timestamps a lot.
+    """
+    if not value:
+        return None
+    match = ISO_DATETIME.match(value)
+    if match:
+        try:
+            return datetime(*(int(part or 0) for part in match.groups()))
+        except ValueError:
+            pass
+    return parse(value)
+
+
+def is_past(value, today):
+    """
+    Schedule timestamp `value` is before `today` (`YYYY-MM-DD`) or empty.
+    ISO strings are compared as strings, others are parsed.
+    """
+    if not value:
+        return True
+    if isinstance(value, str) and ISO_DAY.match(value):
+        return value[:10] < today
+    return parse_datetime(value).date().isoformat() < today
 
 
-class BasePlaceSerializer(serializers.Serializer, ElasticsearchMixin):
+def compile_plan(serializer):
+    """
+    Flat `(name, getter, convert)` plan of bound `serializer` readable
+    fields: `get_*` methods are called directly, other fields keep DRF
+    `get_attribute`/`to_representation`, nested serializers get their
+    own plan.
+    """
+    plan = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.SerializerMethodField):
+            plan.append((name, getattr(serializer, field.method_name), None))
+        elif isinstance(field, serializers.BaseSerializer):
+            nested = compile_plan(field)
+            plan.append((
+                name, field.get_attribute,
+                lambda value, nested=nested: run_plan(nested, value)
+            ))
+        else:
+            plan.append((name, field.get_attribute, field.to_representation))
+    return plan
+
+
+def run_plan(plan, obj):
+    # same steps as `Serializer.to_representation`
+    result = {}
+    for name, getter, convert in plan:
+        if convert is None:
+            result[name] = getter(obj)
+            continue
+        try:
+            value = getter(obj)
+        except SkipField:
+            continue
+        result[name] = None if value is None else convert(value)
+    return result
+
+
+class CompiledSerializerMixin(object):
+    """
+    `fast_data(obj)` gives plain dict equal to `Serializer(obj).data`
+    without DRF per field machinery: plan of fields is compiled once
+    per class on a shared serializer instance.
+    """
+
+    @classmethod
+    def get_plan(cls):
+        # own attribute of class, subclasses don't reuse parent plan
+        if '_plan' not in cls.__dict__:
+            cls._plan = compile_plan(cls())
+        return cls._plan
+
+    @classmethod
+    def fast_data(cls, obj):
+        return run_plan(cls.get_plan(), obj)
+
+
+class BasePlaceSerializer(CompiledSerializerMixin, serializers.Serializer,
+                          ElasticsearchMixin):
     """
     Field mapping to our  ES EventPlace model
     Overrides in providers schema
@@ -61,7 +163,8 @@ class BasePlaceSerializer(serializers.Serializer, ElasticsearchMixin):
         return obj.get('description', '')
 
 
-class BaseEventSerializer(serializers.Serializer, ElasticsearchMixin):
+class BaseEventSerializer(CompiledSerializerMixin, serializers.Serializer,
+                          ElasticsearchMixin):
     """
     Field mapping to our app.model.Event
     Overrides in providers schema
@@ -102,7 +205,7 @@ class BaseEventSerializer(serializers.Serializer, ElasticsearchMixin):
     images = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
     schedules = serializers.SerializerMethodField()
-    dates = serializers.SerializerMethodField()
+    dates = serializers.SerializerMethodField(method_name='get_actual_dates')
     date_added = serializers.SerializerMethodField()
     deleted = serializers.SerializerMethodField()
     counters = serializers.SerializerMethodField()
@@ -113,36 +216,92 @@ class BaseEventSerializer(serializers.Serializer, ElasticsearchMixin):
     currency = serializers.SerializerMethodField()
     formatted_price = serializers.SerializerMethodField()
 
+    chat_card = serializers.SerializerMethodField()
+    next_start = serializers.SerializerMethodField()
+
     def get_date_added(self, obj):
         return datetime.now()
 
+    def get_actual_dates(self, obj):
+        # `dates`, `chat_card` and `next_start` share one `get_dates` call
+        cached = getattr(self, '_actual_dates', None)
+        if cached is None or cached[0] is not obj:
+            cached = self._actual_dates = (obj, self.get_dates(obj))
+        return cached[1]
+
+    @staticmethod
+    def combine(date, time):
+        value = datetime.combine(date, datetime.min.time())
+        if time:
+            hour, minute = time.split(':')
+            value = value.replace(hour=int(hour), minute=int(minute))
+        return value
+
+    def get_next_start(self, obj):
+        """
+        Earliest actual start, single valued sort key for search.
+        Computed at indexing time, reindex keeps it current.
+        """
+        starts = [
+            self.combine(date['start_date'], date['start_time'])
+            for date in self.get_actual_dates(obj)
+            if date['start_date']
+        ]
+        if starts:
+            return min(starts).strftime('%Y-%m-%dT%H:%M:%S')
+
+    def get_chat_card(self, obj):
+        """
+        Ready to send chat bot card, see `VKChat.send_card`.
+        """
+        dates = self.get_actual_dates(obj)
+        date = dates[0] if dates else {}
+        start = end = None
+        if date.get('start_date'):
+            start = self.combine(date['start_date'], date['start_time'])
+        if date.get('end_date'):
+            end = self.combine(date['end_date'], date['end_time'])
+
+        place_title = None
+        place = obj.get('place', None)
+        get_place_title = getattr(self.fields['place'], 'get_title', None)
+        if place and get_place_title:
+            place_title = get_place_title(place)
+        return format_card(
+            self.get_title(obj), place_title,
+            start, end,
+            self.get_description(obj)
+        )
+
     def get_dates(self, obj):
+        """
+        Schedules not finished (or not started) before today, at most
+        `MAX_DATES` of them in schedules order.
+        """
         dates = []
-        now = datetime.now()
+        today = datetime.now().date().isoformat()
         schedules = self.get_schedules(obj) or []
-        for schedule in schedules:
-            actual = {}
-            start = schedule.get('start_date', None)
-            end = schedule.get('end_date', None)
-
-            start = parse(start) if start else None
-            end = parse(end) if end else None
-            # start_time = parse(start_date).strftime('%H:%M')
-            # end_time = parse(end_date).strftime('%H:%M')
-
-            if end and end.date() >= now.date():
-                actual['start_date'] = start.date() if start else None
-                actual['start_time'] = start.strftime('%H:%M') if start else None
-                actual['end_date'] = end.date()
-                actual['end_time'] = end.strftime('%H:%M')
-            elif start and start.date() >= now.date():
-                actual['start_date'] = start.date()
-                actual['start_time'] = start.strftime('%H:%M')
-                actual['end_date'] = end.date() if end else None
-                actual['end_time'] = end.strftime('%H:%M') if end else None
-            if actual:
-                dates.append(actual)
-        return dates[:300]
+        # past schedules (most of long running events) are dropped in
+        # one pass over raw strings, only actual ones get parsed
+        actual = [
+            schedule for schedule in schedules
+            if not (is_past(schedule.get('end_date', None), today) and
+                    is_past(schedule.get('start_date', None), today))
+        ]
+        for schedule in actual:
+            start = parse_datetime(schedule.get('start_date', None))
+            end = parse_datetime(schedule.get('end_date', None))
+            dates.append({
+                'start_date': start.date() if start else None,
+                'start_time': '%02d:%02d' % (start.hour, start.minute)
+                if start else None,
+                'end_date': end.date() if end else None,
+                'end_time': '%02d:%02d' % (end.hour, end.minute)
+                if end else None,
+            })
+            if len(dates) >= MAX_DATES:
+                break
+        return dates
 
     def get_provider(self, obj):
         return self.provider
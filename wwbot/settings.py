@@ -15,6 +15,9 @@ import os
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# runtime caches and generated files, not in git
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/1.11/howto/deployment/checklist/
@@ -139,6 +142,102 @@ ELASTICSEARCH_CONNECTION_PARAMS = {
     'timeout': 60,
 }
 
+DIALOGFLOW_OPTIONS = {
+    'lang': 'ru',
+    'timeout': 5,
+    'retries': 2,
+    'pool_size': 100,
+}
+
+# max users answered by VKChat at the same time
+VKCHAT_CONCURRENCY = 10
+
+GEOCODE_CACHE = {
+    'path': os.path.join(DATA_DIR, 'geocode_cache.json'),
+    'save_delay': 5.0,
+    'maxsize': 4096,
+    'ttl': 30 * 24 * 60 * 60,
+    'negative_ttl': 24 * 60 * 60,
+}
+
+# VK requests per second: 20 for community token, 3 for user token
+VK_RATE_LIMIT = {
+    'rate': 20,
+    'retries': 3,
+}
+
+# VK calls made within `delay` seconds go in one `execute`
+VK_EXECUTE_BATCHER = {
+    'max_calls': 25,
+    'delay': 0.01,
+}
+
+PHOTO_UPLOADER = {
+    'timeout': 15,
+    'pool_size': 20,
+    'cache_size': 10000,
+    'cache_ttl': 30 * 24 * 60 * 60,
+}
+
+# `VKChat` preuploads event photos every `PHOTO_PRELOADER_INTERVAL`
+# seconds on its own VK limit (None disables), also used by
+# `./manage.py runscript preupload_photos`
+PHOTO_PRELOADER = {
+    'batch_size': 5,
+    'delay': 1.0,
+}
+PHOTO_PRELOADER_INTERVAL = 10 * 60
+
+# `./manage.py runscript build_gazetteer` fills vk_cities coordinates
+GAZETTEER = {
+    'coords_path': os.path.join(DATA_DIR, 'gazetteer.json'),
+}
+
+# `services.elastic.aio.AsyncTransport` used by the chat bot
+ELASTICSEARCH_ASYNC_PARAMS = {
+    'timeout': 10,
+    'pool_size': 100,
+}
+
+# concurrent chat searches within `max_wait` seconds go in one `_msearch`
+ELASTICSEARCH_MSEARCH = {
+    'max_batch': 20,
+    'max_wait': 0.005,
+}
+
+# `Event.search_events` results cache, dropped on `event-index` writes
+EVENT_SEARCH_CACHE = {
+    'maxsize': 1000,
+    'ttl': 5 * 60,
+}
+
+# per-user paging state of VKChat, idle users are evicted
+VKCHAT_CONVERSATIONS = {
+    'maxsize': 10000,
+    'idle_ttl': 30 * 60,
+}
+
+# geohash cells of upcoming events for radius queries without text,
+# `VKChat` rebuilds it every `EVENT_GEOCELLS_REFRESH_INTERVAL` seconds
+EVENT_GEOCELLS = {
+    'precision': 5,
+    'max_age': 15 * 60,
+}
+EVENT_GEOCELLS_REFRESH_INTERVAL = 5 * 60
+
+# events starting within next `days` days in NumPy columns, updated
+# incrementally with `EVENT_GEOCELLS_REFRESH_INTERVAL` too
+EVENT_HOTSET = {
+    'days': 7,
+    'max_age': 15 * 60,
+    'rebuild_interval': 60 * 60,
+}
+
+# embedded SQLite backend of `Event.search_events` instead of ES,
+# e.g. {'path': os.path.join(BASE_DIR, 'events.sqlite3')},
+# fill it with `./manage.py runscript load_local_search`
+EVENT_LOCAL_SEARCH = None
+
 ELASTICSEARCH_TYPE_CLASSES = (
     'services.elastic.models.Event',
     'services.elastic.models.EventPlace',